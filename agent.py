@@ -1,14 +1,28 @@
+import asyncio
 import json
 import os
+import re
+from contextlib import asynccontextmanager
 from enum import Enum
 import base64
 from pydantic import BaseModel
 from config import CONFIG
 from agents import (
     Agent,
+    FunctionTool,
+    Model,
+    ModelProvider,
+    ModelSettings,
 )
 from agents.mcp import MCPServer, MCPServerStdio, MCPServerSse
 from agents.extensions.handoff_prompt import RECOMMENDED_PROMPT_PREFIX
+from cache import GITHUB_READ_ONLY_TOOLS, NOTION_READ_ONLY_TOOLS, CachedMCPServer
+from issues import IssueIndex, mcp_issue_fetcher, similar_issues_tool
+from models import ModelSelector
+from search import SearchIndex, search_tool
+from startup import STARTUP
+from traces import TRACE_URL, TraceCache, mcp_trace_fetcher, trace_tools
+from supervisor import ServerSupervisor, supervised_tool
 
 class AgentContext(BaseModel):
     user: str | None = None
@@ -17,10 +31,10 @@ class TriageKindEnum(str, Enum):
     question = 'question'
     bug_report = 'bug_report'
 
-def _github_agent(github_server: MCPServer) -> Agent[AgentContext]:
+def _github_agent(github_server: MCPServer, model: Model) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="GitHub Agent",
-        model="gpt-4.1",
+        model=model,
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
             f"""
@@ -33,10 +47,10 @@ def _github_agent(github_server: MCPServer) -> Agent[AgentContext]:
         mcp_servers=[github_server],
     )
 
-def _issue_agent(github_server: MCPServer) -> Agent[AgentContext]:
+def _issue_agent(github_server: MCPServer, model: Model, tools: list[FunctionTool]) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="Issue Agent",
-        model="gpt-4.1",
+        model=model,
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
             f"""
@@ -59,17 +73,21 @@ def _issue_agent(github_server: MCPServer) -> Agent[AgentContext]:
                 - Why the feature is needed
                 - How the feature should work
 
+            Before creating an issue, check for duplicates with the find similar issues tool, which is instant.
+            If an existing issue covers the same problem, reference it (and comment on it if there's new information) instead of filing a new one.
+
             If you end up creating or updating an issue, always reference the issue URL in your response.
             If the repository name is not specified, use the default repository: {CONFIG.GITHUB_REPO}
             """
         ),
+        tools=tools,
         mcp_servers=[github_server],
     )
 
-def _notion_agent(notion_server: MCPServer) -> Agent[AgentContext]:
+def _notion_agent(notion_server: MCPServer, model: Model) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="Notion Agent",
-        model="gpt-4.1",
+        model=model,
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
             """
@@ -83,10 +101,10 @@ class SummaryOutput(BaseModel):
     title: str
     summary: str
 
-def _summary_agent()  -> Agent[AgentContext]:
+def _summary_agent(model: Model) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="Summary Agent",
-        model="gpt-4.1",
+        model=model,
         handoff_description="An agent that can summarize a conversation",
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
@@ -108,10 +126,10 @@ def _summary_agent()  -> Agent[AgentContext]:
         output_type=SummaryOutput,
     )
 
-def _sandbox_agent(sandbox_server: MCPServer)  -> Agent[AgentContext]:
+def _sandbox_agent(sandbox_server: MCPServer, model: Model) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="Sandbox Agent",
-        model="gpt-4.1",
+        model=model,
         handoff_description="An agent that can execute code in an isolated sandbox",
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
@@ -121,6 +139,10 @@ def _sandbox_agent(sandbox_server: MCPServer)  -> Agent[AgentContext]:
             Use your tools to execute code.
 
             If the code is a snippet, wrap it in a main function and execute it. Don't forget to include any import statements.
+            If the code needs third-party packages, pass them as dependencies.
+            To try several variants of a snippet, execute them all at once with a single batch call.
+            Executions are time, CPU, memory and output limited. Check the exit code and stderr of the results,
+            and tell the user when an execution was killed or its output truncated.
 
             DO NOT EXECUTE CODE THAT MIGHT CAUSE DAMAGE TO THE SYSTEM OR TO OTHER USERS. THIS IS YOUR PRIME DIRECTIVE.
             """
@@ -128,10 +150,17 @@ def _sandbox_agent(sandbox_server: MCPServer)  -> Agent[AgentContext]:
         mcp_servers=[sandbox_server],
     )
 
-def _cloud_agent(cloud_server: MCPServer)  -> Agent[AgentContext]:
+# Added to the cloud agent's instructions along with the trace tools, when the cloud MCP
+# server can fetch whole traces (see Triager._enable_trace_tools)
+_TRACE_TOOLS_INSTRUCTIONS = """
+            Start with the trace summary, failed steps, slowest spans and critical path tools: they are precomputed and answer most questions.
+            Only page through spans with the Dagger Cloud tools for details they don't cover.
+            """
+
+def _cloud_agent(cloud_server: MCPServer, model: Model) -> Agent[AgentContext]:
     return Agent[AgentContext](
         name="Dagger Cloud Agent",
-        model="gpt-4.1",
+        model=model,
         handoff_description="An agent that can analyze Dagger Cloud traces",
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
@@ -150,49 +179,96 @@ class TriageOutput(BaseModel):
     title: str
     summary: str
 
-def _main_agent(github_server: MCPServer, notion_server: MCPServer, sandbox_server: MCPServer, cloud_server: MCPServer):
+_TOOL_DESCRIPTIONS = {
+    "issue_agent": "agent responsible for filing issues and bug reports",
+    "github_agent": "generic agent to interact with GitHub (can manipulate repos, PRs, issues, commits, etc)",
+    "notion_agent": "agent responsible for interacting with Notion",
+    "sandbox_agent": "agent responsible for executing code in an isolated sandbox",
+    "cloud_agent": "agent responsible for analyzing Dagger Cloud traces",
+}
+
+def _specialist_agents(github_server: MCPServer, notion_server: MCPServer, sandbox_server: MCPServer, cloud_server: MCPServer, models: ModelSelector, issues: IssueIndex) -> dict[str, Agent[AgentContext]]:
+    return {
+        "issue_agent": _issue_agent(github_server, models.model("issue"), [similar_issues_tool(issues)]),
+        "github_agent": _github_agent(github_server, models.model("github")),
+        "notion_agent": _notion_agent(notion_server, models.model("notion")),
+        "sandbox_agent": _sandbox_agent(sandbox_server, models.model("sandbox")),
+        "cloud_agent": _cloud_agent(cloud_server, models.model("cloud")),
+    }
+
+def _main_agent(specialists: dict[str, Agent[AgentContext]], model: Model, tools: list[FunctionTool]):
     return Agent[AgentContext](
         name="Triage Agent",
-        model="gpt-4.1",
+        model=model,
         handoff_description="A triage agent that can delegate a user's request to the appropriate agent.",
         instructions=(
             f"{RECOMMENDED_PROMPT_PREFIX} "
             """
             You are a helpful Discord bot. You can use your tools to help answer questions and perform tasks.
+            For questions about Dagger, search the local knowledge base first when you have it, and answer from the snippets, linking their sources.
             If a specialized agent better suited to the user's request is available, delegate to it.
+            When the request has several independent parts (for instance analyzing a trace and finding the related GitHub issue),
+            call all the agents needed at once, in a single turn, rather than one after the other. Then combine their results in one answer.
             Your response will be sent verbatim back to the user, so speak in the appropriate tone.
             """
         ),
+        # Tool calls of the same turn run concurrently: compound requests take as long as the slowest part
+        model_settings=ModelSettings(parallel_tool_calls=True),
         # output_type=TriageOutput,
         tools = [
-            _issue_agent(github_server).as_tool(
-                tool_name="issue_agent",
-                tool_description="agent responsible for filing issues and bug reports",
-            ),
-            _github_agent(github_server).as_tool(
-                tool_name="github_agent",
-                tool_description="generic agent to interact with GitHub (can manipulate repos, PRs, issues, commits, etc)",
-            ),
-            _notion_agent(notion_server).as_tool(
-                tool_name="notion_agent",
-                tool_description="agent responsible for interacting with Notion",
-            ),
-            _sandbox_agent(sandbox_server).as_tool(
-                tool_name="sandbox_agent",
-                tool_description="agent responsible for executing code in an isolated sandbox",
-            ),
-            _cloud_agent(cloud_server).as_tool(
-                tool_name="cloud_agent",
-                tool_description="agent responsible for analyzing Dagger Cloud traces",
-            ),
-        ],
+            agent.as_tool(
+                tool_name=tool_name,
+                tool_description=_TOOL_DESCRIPTIONS[tool_name],
+            )
+            for tool_name, agent in specialists.items()
+        ] + tools,
         # handoffs=[
         #     # issue_agent,
         #     # github_agent,
         # ],
     )
 
-def _mcp_server_docker(image: str, env: dict[str, str]) -> MCPServer:
+_GITHUB_URL = re.compile(r"https?://github\.com/[\w.-]+/[\w.-]+/(?:issues|pull)/\d+")
+_CODE_BLOCK = re.compile(r"```.*?```", re.DOTALL)
+_RUN_REQUEST = re.compile(r"\b(?:run|execute)\s+(?:this|it|that)\b", re.IGNORECASE)
+
+class Router():
+    """
+    Routes obvious requests straight to a specialist agent, skipping the triage model call.
+
+    Returns None when no rule matches, or when rules disagree, in which case the triage
+    agent decides.
+    """
+
+    def __init__(self):
+        self.hits: dict[str, int] = {}
+        self.misses = 0
+
+    def routes(self, message: str) -> set[str]:
+        """All the specialists the message obviously needs."""
+        routes = set()
+        if TRACE_URL.search(message):
+            routes.add("cloud_agent")
+        if _GITHUB_URL.search(message):
+            routes.add("github_agent")
+        if _CODE_BLOCK.search(message) and _RUN_REQUEST.search(_CODE_BLOCK.sub("", message)):
+            routes.add("sandbox_agent")
+        return routes
+
+    def route(self, message: str) -> str | None:
+        routes = self.routes(message)
+        if len(routes) != 1:
+            self.misses += 1
+            return None
+        route = routes.pop()
+        self.hits[route] = self.hits.get(route, 0) + 1
+        return route
+
+    def hit_rate(self) -> float:
+        total = sum(self.hits.values()) + self.misses
+        return sum(self.hits.values()) / total if total else 0.0
+
+def _mcp_server_docker(name: str, image: str, env: dict[str, str]) -> MCPServer:
     # docker run -i --rm [-e <vars>] <image>
     args = [
         "run",
@@ -204,6 +280,7 @@ def _mcp_server_docker(image: str, env: dict[str, str]) -> MCPServer:
     args.append(image)
 
     mcp_server = MCPServerStdio(
+        name=name,
         params={
             "command": "docker",
             "args": args,
@@ -213,7 +290,7 @@ def _mcp_server_docker(image: str, env: dict[str, str]) -> MCPServer:
     )
     return mcp_server
 
-def _mcp_server_dagger(module: str) -> MCPServer:
+def _mcp_server_dagger(name: str, module: str) -> MCPServer:
     # dagger -m <module> mcp
     args = [
         "-m",
@@ -221,6 +298,7 @@ def _mcp_server_dagger(module: str) -> MCPServer:
         "mcp",
     ]
     mcp_server = MCPServerStdio(
+        name=name,
         client_session_timeout_seconds=30,
         params={
             "command": "dagger",
@@ -235,27 +313,42 @@ def _mcp_server_dagger(module: str) -> MCPServer:
     )
     return mcp_server
 
-class Triager():
-    def __init__(self):
-        self._github_mcp_server = _mcp_server_docker(
+def _mcp_servers() -> dict[str, MCPServer]:
+    github = CachedMCPServer(
+        _mcp_server_docker(
+            name="github",
             image="ghcr.io/github/github-mcp-server",
             env={
                 "GITHUB_PERSONAL_ACCESS_TOKEN": CONFIG.GITHUB_TOKEN,
             },
-        )
+        ),
+        read_only_tools=GITHUB_READ_ONLY_TOOLS,
+        max_size=CONFIG.MCP_TOOL_CACHE_SIZE,
+        ttl=CONFIG.MCP_TOOL_CACHE_TTL,
+    )
 
-        self._notion_mcp_server = _mcp_server_docker(
+    notion = CachedMCPServer(
+        _mcp_server_docker(
+            name="notion",
             image="mcp/notion",
             env={
                 "OPENAPI_MCP_HEADERS": json.dumps({"Authorization": "Bearer " + CONFIG.NOTION_TOKEN ,"Notion-Version": "2022-06-28"}),
             },
-        )
+        ),
+        read_only_tools=NOTION_READ_ONLY_TOOLS,
+        max_size=CONFIG.MCP_TOOL_CACHE_SIZE,
+        ttl=CONFIG.MCP_TOOL_CACHE_TTL,
+    )
 
-        self._sandbox_mcp_server = _mcp_server_dagger(
-            module="./sandbox",
-        )
+    sandbox = _mcp_server_dagger(
+        name="sandbox",
+        module="./sandbox",
+    )
 
-        self._cloud_mcp_server = MCPServerSse(
+    # Only the tool listing and trace fetches are cached, other cloud tools aren't known to be read-only
+    cloud = CachedMCPServer(
+        MCPServerSse(
+            name="cloud",
             params={
                 # "url": "http://localhost:8020/mcp",
                 "url": "https://mcp-api.preview.dagger.cloud/mcp",
@@ -266,24 +359,191 @@ class Triager():
                 #     # "Authorization": f"Bearer {CONFIG.DAGGER_TOKEN}",
                 # },
             },
-        )
+        ),
+        read_only_tools={CONFIG.CLOUD_TRACE_TOOL},
+    )
+
+    return {
+        "github": github,
+        "notion": notion,
+        "sandbox": sandbox,
+        "cloud": cloud,
+    }
 
+class Triager():
+    def __init__(self, servers: dict[str, MCPServer] | None = None, model_provider: ModelProvider | None = None):
+        # Servers and models can be swapped, e.g. for stand-ins when benchmarking
+        self.models = ModelSelector.from_config(provider=model_provider)
+        if servers is None:
+            servers = _mcp_servers()
+        self._github_mcp_server = servers["github"]
+        self._notion_mcp_server = servers["notion"]
+        self._sandbox_mcp_server = servers["sandbox"]
+        self._cloud_mcp_server = servers["cloud"]
+
+        # Traces linked in mentions are fetched while triage runs, once the cloud MCP server
+        # is known to have the tool to fetch them (see _enable_trace_tools)
+        self._trace_tools_checked = False
+        self.trace_tools_enabled = False
+        self._fetch_trace_tool = mcp_trace_fetcher(self._cloud_mcp_server, CONFIG.CLOUD_TRACE_TOOL)
+        self.traces = TraceCache(CONFIG.TRACE_CACHE_DIR, fetch=self._fetch_trace, ttl=CONFIG.TRACE_CACHE_TTL)
+
+        # Open and recent issues, for instant duplicate checks
+        self.issues = IssueIndex(
+            CONFIG.ISSUE_INDEX_PATH,
+            fetch=mcp_issue_fetcher(self._call_github, CONFIG.GITHUB_REPO),
+            refresh_interval=CONFIG.ISSUE_INDEX_REFRESH_INTERVAL,
+            max_age_days=CONFIG.ISSUE_INDEX_MAX_AGE_DAYS,
+        )
 
-        self.agent = _main_agent(
+        self.specialists = _specialist_agents(
             github_server=self._github_mcp_server,
             notion_server=self._notion_mcp_server,
             sandbox_server=self._sandbox_mcp_server,
             cloud_server=self._cloud_mcp_server,
+            models=self.models,
+            issues=self.issues,
+        )
+        # Local search over a docs and issues snapshot, when an index was built (see main.py --build-index)
+        tools = []
+        if os.path.exists(os.path.join(CONFIG.SEARCH_INDEX_DIR, "meta.json")):
+            self.search_index = SearchIndex(CONFIG.SEARCH_INDEX_DIR)
+            tools.append(search_tool(self.search_index))
+            print(f"Loaded search index: {len(self.search_index)} passages")
+        self.agent = _main_agent(self.specialists, self.models.model("triage"), tools)
+        self.summary_agent = _summary_agent(self.models.model("summary"))
+        self.router = Router()
+        self._prewarm_task: asyncio.Task | None = None
+        self._connected = asyncio.Event()
+
+        # Lazy servers are only started when their agent tool is first used, and stopped once idle
+        self._supervisors = [
+            ServerSupervisor(
+                server,
+                lazy=server.name in CONFIG.MCP_LAZY_SERVERS,
+                idle_timeout=CONFIG.MCP_IDLE_TIMEOUT,
+                health_check_interval=CONFIG.MCP_HEALTH_CHECK_INTERVAL,
+                backoff_max=CONFIG.MCP_RECONNECT_BACKOFF_MAX,
+            )
+            for server in [
+                self._github_mcp_server,
+                self._notion_mcp_server,
+                self._sandbox_mcp_server,
+                self._cloud_mcp_server,
+            ]
+        ]
+
+        # Agent tools activate their MCP server on use, and are reported as unavailable while it's down
+        tool_servers = {
+            "issue_agent": self._github_mcp_server,
+            "github_agent": self._github_mcp_server,
+            "notion_agent": self._notion_mcp_server,
+            "sandbox_agent": self._sandbox_mcp_server,
+            "cloud_agent": self._cloud_mcp_server,
+        }
+        supervisors = {supervisor.server: supervisor for supervisor in self._supervisors}
+        self._tool_supervisors = {
+            tool_name: supervisors[server] for tool_name, server in tool_servers.items()
+        }
+        self.agent.tools = [
+            supervised_tool(tool, self._tool_supervisors[tool.name])
+            if tool.name in self._tool_supervisors else tool
+            for tool in self.agent.tools
+        ]
+
+    async def _fetch_trace(self, url: str, org: str, trace_id: str):
+        async with self._tool_supervisors["cloud_agent"].use() as available:
+            if not available:
+                raise RuntimeError("The Dagger Cloud MCP server is unavailable")
+            return await self._fetch_trace_tool(url, org, trace_id)
+
+    async def _call_github(self, tool_name: str, arguments: dict):
+        async with self._tool_supervisors["issue_agent"].use() as available:
+            if not available:
+                raise RuntimeError("The GitHub MCP server is unavailable")
+            return await self._github_mcp_server.call_tool(tool_name, arguments)
+
+    @asynccontextmanager
+    async def select_agent(self, message: str):
+        """Yields the agent that should handle the message: a specialist when the route is obvious, the triage agent otherwise."""
+        # The cloud MCP server may have come up after startup
+        await self._enable_trace_tools()
+        if self.trace_tools_enabled:
+            self.traces.prefetch(message)
+        route = self.router.route(message)
+        if route is None:
+            yield self.agent
+            return
+
+        print(f"Fast path: routing to {route}")
+        async with self._tool_supervisors[route].use() as available:
+            yield self.specialists[route] if available else self.agent
+
+    async def prewarm_sandbox(self):
+        # dagger -m <module> call warm
+        process = await asyncio.create_subprocess_exec(
+            "dagger", "-m", "./sandbox", "call", "warm",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
+        stdout, stderr = await process.communicate()
+        if process.returncode != 0:
+            print(f"Failed to pre-warm sandbox: {stderr.decode()}")
+            return
+        print(f"Sandbox pre-warmed:\n{stdout.decode()}")
 
     async def connect(self):
-        await self._github_mcp_server.connect()
-        await self._notion_mcp_server.connect()
-        # await self._sandbox_mcp_server.connect()
-        await self._cloud_mcp_server.connect()
+        if CONFIG.SANDBOX_PREWARM:
+            # Pull sandbox images in the background, doesn't hold up startup
+            self._prewarm_task = asyncio.create_task(self.prewarm_sandbox())
+
+        # Servers connect concurrently, startup takes as long as the slowest one.
+        # Servers that fail keep retrying in the background.
+        for supervisor in self._supervisors:
+            supervisor.start()
+
+        async def ready(supervisor: ServerSupervisor):
+            with STARTUP.phase(f"mcp_connect:{supervisor.name}"):
+                await supervisor.wait_ready()
+
+        await asyncio.gather(*[ready(supervisor) for supervisor in self._supervisors])
+        self._connected.set()
+        self.issues.start()
+        await self._enable_trace_tools()
+        for supervisor in self._supervisors:
+            if not supervisor.lazy and not supervisor.available:
+                print(f"MCP server {supervisor.name} is unavailable, continuing without it")
+
+    async def _enable_trace_tools(self):
+        # Checked once the cloud MCP server is up: it may not have the configured tool
+        supervisor = self._tool_supervisors["cloud_agent"]
+        if self._trace_tools_checked or not supervisor.available:
+            return
+        try:
+            async with supervisor.use() as available:
+                if not available:
+                    return
+                tools = await self._cloud_mcp_server.list_tools()
+        except Exception as e:
+            print(f"Failed to list the {self._cloud_mcp_server.name} MCP server tools: {e}")
+            return
+        self._trace_tools_checked = True
+        if CONFIG.CLOUD_TRACE_TOOL not in {tool.name for tool in tools}:
+            print(f"The {self._cloud_mcp_server.name} MCP server has no {CONFIG.CLOUD_TRACE_TOOL} tool, trace tools are disabled")
+            return
+
+        cloud_agent = self.specialists["cloud_agent"]
+        cloud_agent.tools = [*cloud_agent.tools, *trace_tools(self.traces)]
+        cloud_agent.instructions += _TRACE_TOOLS_INSTRUCTIONS
+        self.trace_tools_enabled = True
+
+    async def wait_connected(self):
+        # The bot connects to Discord while the MCP servers connect (see Bot.setup_hook):
+        # requests received in the meantime wait for them
+        await self._connected.wait()
 
     async def cleanup(self):
-        await self._github_mcp_server.cleanup()
-        await self._notion_mcp_server.cleanup()
-        # await self._sandbox_mcp_server.cleanup()
-        await self._cloud_mcp_server.cleanup()
+        if self._prewarm_task is not None:
+            self._prewarm_task.cancel()
+        await self.issues.stop()
+        await asyncio.gather(*[supervisor.stop() for supervisor in self._supervisors])
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any
+
+from agents import Model, ModelProvider, ModelResponse, ModelSettings, ModelTracing, Tool, Usage
+from agents.mcp import MCPServer
+from agents.tracing import set_trace_processors
+from mcp.types import CallToolResult, TextContent, Tool as MCPTool
+from agents.items import ItemHelpers
+from openai.types.responses import (
+    Response,
+    ResponseCompletedEvent,
+    ResponseFunctionToolCall,
+    ResponseOutputMessage,
+    ResponseOutputText,
+    ResponseTextDeltaEvent,
+    ResponseUsage,
+)
+
+from agent import Router
+from context import count_tokens
+from dev import MockBot
+from history import HistoryEntry
+from metrics import METRICS, stage
+
+
+class Conversation:
+    """A recorded mention, with the message it references and the channel history at the time."""
+
+    def __init__(self, mention: str, reference: str | None, history: list[HistoryEntry]):
+        self.mention = mention
+        self.reference = reference
+        self.history = history
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Conversation":
+        def formatted(message: dict | str) -> str:
+            if isinstance(message, str):
+                message = {"user": "test", "created_at": datetime.now().isoformat(), "message": message}
+            return json.dumps(message)
+
+        history = []
+        for i, message in enumerate(data.get("history", [])):
+            history.append(HistoryEntry(
+                id=i,
+                author_id=0,
+                created_at=datetime.fromisoformat(message["created_at"]),
+                content=message["message"],
+                formatted=formatted(message),
+            ))
+        reference = data.get("reference")
+        return cls(
+            mention=formatted(data["mention"]),
+            reference=formatted(reference) if reference is not None else None,
+            history=history,
+        )
+
+    @property
+    def text(self) -> str:
+        return json.loads(self.mention)["message"]
+
+
+def load_conversations(paths: list[str]) -> list[Conversation]:
+    conversations = []
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    conversations.append(Conversation.from_json(json.loads(line)))
+    return conversations
+
+
+def _input_text(input: str | list) -> str:
+    if isinstance(input, str):
+        return input
+    texts = []
+    for item in input:
+        content = item.get("content") if isinstance(item, dict) else None
+        if isinstance(content, str):
+            texts.append(content)
+    return "\n".join(texts)
+
+
+class StubModel(Model):
+    """
+    Stand-in for a model: waits `latency` seconds, then calls the tools picked with the
+    fast-path router rules (or the first tool) in a single turn, and answers once they returned.
+    """
+
+    def __init__(self, name: str, latency: float):
+        self._name = name
+        self._latency = latency
+        self._router = Router()
+
+    async def get_response(
+        self,
+        system_instructions: str | None,
+        input: str | list,
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: Any,
+        handoffs: list,
+        tracing: ModelTracing,
+        *,
+        previous_response_id: str | None,
+    ) -> ModelResponse:
+        with stage("model_call", model=self._name):
+            await asyncio.sleep(self._latency)
+
+        text = _input_text(input)
+        answered = isinstance(input, list) and any(
+            isinstance(item, dict) and item.get("type") == "function_call_output" for item in input
+        )
+        if answered or not tools:
+            output = [ResponseOutputMessage(
+                id="msg_stub",
+                type="message",
+                role="assistant",
+                status="completed",
+                content=[ResponseOutputText(type="output_text", text="Stub response", annotations=[])],
+            )]
+        else:
+            # Compound requests fan out to every specialist they need, in a single turn
+            routes = self._router.routes(text)
+            selected = [tool for tool in tools if tool.name in routes] or tools[:1]
+            output = [
+                ResponseFunctionToolCall(
+                    id="fc_stub",
+                    call_id=f"call_{time.monotonic_ns()}_{i}",
+                    type="function_call",
+                    status="completed",
+                    name=tool.name,
+                    arguments=json.dumps({key: text[:200] for key in getattr(tool, "params_json_schema", {}).get("properties", {})}),
+                )
+                for i, tool in enumerate(selected)
+            ]
+
+        return ModelResponse(
+            output=output,
+            usage=Usage(requests=1, input_tokens=count_tokens(text), output_tokens=10, total_tokens=count_tokens(text) + 10),
+            response_id=None,
+        )
+
+    async def stream_response(
+        self,
+        system_instructions: str | None,
+        input: str | list,
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: Any,
+        handoffs: list,
+        tracing: ModelTracing,
+        *,
+        previous_response_id: str | None,
+    ):
+        # The same output as get_response: its text in one delta, then the completed response
+        response = await self.get_response(
+            system_instructions,
+            input,
+            model_settings,
+            tools,
+            output_schema,
+            handoffs,
+            tracing,
+            previous_response_id=previous_response_id,
+        )
+        for i, item in enumerate(response.output):
+            if isinstance(item, ResponseOutputMessage):
+                yield ResponseTextDeltaEvent.model_construct(
+                    type="response.output_text.delta",
+                    item_id=item.id,
+                    output_index=i,
+                    content_index=0,
+                    delta=ItemHelpers.extract_last_text(item) or "",
+                )
+        yield ResponseCompletedEvent.model_construct(
+            type="response.completed",
+            response=Response.model_construct(
+                id="resp_stub",
+                object="response",
+                output=response.output,
+                usage=ResponseUsage.model_construct(
+                    input_tokens=response.usage.input_tokens,
+                    output_tokens=response.usage.output_tokens,
+                    total_tokens=response.usage.total_tokens,
+                ),
+            ),
+        )
+
+
+class StubModelProvider(ModelProvider):
+    def __init__(self, latency: float):
+        self._latency = latency
+
+    def get_model(self, model_name: str | None) -> Model:
+        return StubModel(model_name or "stub", self._latency)
+
+
+class StubMCPServer(MCPServer):
+    """Stand-in for an MCP server exposing a single tool answering after `latency` seconds."""
+
+    def __init__(self, name: str, latency: float):
+        self._name = name
+        self._latency = latency
+        self.session = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    async def connect(self):
+        # Used as its own session, for the supervisor health checks
+        self.session = self
+
+    async def send_ping(self):
+        pass
+
+    async def cleanup(self):
+        self.session = None
+
+    async def list_tools(self) -> list[MCPTool]:
+        return [
+            MCPTool(
+                name=f"{self._name}_lookup",
+                description=f"Looks something up in {self._name}",
+                inputSchema={"type": "object", "properties": {"query": {"type": "string"}}},
+            ),
+        ]
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None) -> CallToolResult:
+        await asyncio.sleep(self._latency)
+        return CallToolResult(content=[TextContent(type="text", text=f"Stub {tool_name} result")])
+
+
+def stub_servers(latency: float) -> dict[str, MCPServer]:
+    return {name: StubMCPServer(name, latency) for name in ["github", "notion", "sandbox", "cloud"]}
+
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+async def run_benchmark(bot, conversations: list[Conversation], requests: int, rate: float):
+    """Replays `requests` conversations through `bot` at `rate` requests per second and prints a report."""
+    latencies: list[float] = []
+    failures = 0
+
+    async def one(conversation: Conversation):
+        nonlocal failures
+        start = time.monotonic()
+        try:
+            await bot.on_conversation(conversation)
+            latencies.append(time.monotonic() - start)
+        except Exception as e:
+            failures += 1
+            print(f"Request failed: {e}")
+
+    start = time.monotonic()
+    tasks = []
+    for i in range(requests):
+        # Open loop: requests arrive at the target rate regardless of completions
+        await asyncio.sleep(max(0.0, start + i / rate - time.monotonic()))
+        tasks.append(asyncio.create_task(one(conversations[i % len(conversations)])))
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - start
+
+    print(f"Requests:   {len(latencies)} ok, {failures} failed in {elapsed:.2f}s")
+    print(f"Throughput: {len(latencies) / elapsed:.2f} req/s (target {rate:.2f})")
+    print(f"Latency:    p50={_percentile(latencies, 0.50):.3f}s p95={_percentile(latencies, 0.95):.3f}s p99={_percentile(latencies, 0.99):.3f}s")
+    print("Stages:")
+    for (name, labels), histogram in sorted(METRICS.stages().items()):
+        labels = ",".join(f"{key}={value}" for key, value in labels)
+        print(f"  {name:<16} {labels:<32} n={histogram.count:<6} mean={histogram.sum / histogram.count:.3f}s")
+
+
+async def benchmark(paths: list[str], requests: int, rate: float, model_latency: float, mcp_latency: float):
+    """Runs the replay benchmark against stand-in models and MCP servers, with no network access."""
+    # Keep spans local: only feed them to the metrics
+    set_trace_processors([])
+    METRICS.install()
+
+    conversations = load_conversations(paths)
+    if not conversations:
+        raise ValueError("No conversations to replay")
+
+    bot = await MockBot.create(
+        servers=stub_servers(mcp_latency),
+        model_provider=StubModelProvider(model_latency),
+    )
+    try:
+        await run_benchmark(bot, conversations, requests=requests, rate=rate)
+    finally:
+        await bot.cleanup()
@@ -1,45 +1,139 @@
+import asyncio
+import hashlib
+
 import discord
-import json
 from agent import AgentContext, Triager
 from agents import Runner, trace
+from cache import MCP_WRITES
+from config import CONFIG
+from context import ContextBuilder
+from dispatch import Dispatcher
+from governor import GOVERNOR
+from history import HistoryEntry, HistoryStore, format_message
+from metrics import METRICS, stage
+from response_cache import ResponseCache
+from sessions import Session, SessionStore, StateSessionStore
+from similarity import MinHasher, normalize, shingles, similarity
+from startup import STARTUP
+from state import backend_from_url
+from streaming import StreamingReply
 
-def format_message(message: discord.Message) -> dict:
-    return json.dumps({
-        "user": message.author.name,
-        "created_at": message.created_at.isoformat(),
-        "message": message.clean_content,
-    })
-
-def message_to_input(message: discord.Message, bot_user: discord.User):
-    if message.author == bot_user:
-        return {"content": message.clean_content, "role": "assistant"}
-    return {"content": format_message(message), "role": "user"}
+def message_to_input(message: HistoryEntry, bot_user: discord.User):
+    if message.author_id == bot_user.id:
+        return {"content": message.content, "role": "assistant"}
+    return {"content": message.formatted, "role": "user"}
 
 async def get_thread_starter_message(thread: discord.Thread) -> discord.Message | None:
     if thread.starter_message is not None:
         return thread.starter_message
 
     # If starter_message is not in cache, fetch the oldest message
-    history = [message async for message in thread.history(limit=1, oldest_first=True)]
+    async def fetch():
+        await GOVERNOR.discord("history", thread.id)
+        return [message async for message in thread.history(limit=1, oldest_first=True)]
+
+    history = await GOVERNOR.coalesce(("starter", thread.id), fetch)
     if not history:
         return None
     return history[0]
 
-class Bot(discord.Client):
+def _conversation_key(message: discord.Message, history: list[HistoryEntry]) -> str:
+    # The channel, and the messages preceding the mention that the query may include
+    ids = ",".join(str(entry.id) for entry in history if entry.id != message.id)
+    return f"{message.channel.id}:" + hashlib.sha256(ids.encode()).hexdigest()
+
+# Questions up to this long are answered first (see Bot._priority)
+SHORT_QUESTION_LENGTH = 200
+# Estimated similarity above which a question is taken as a correction of an earlier one
+SUPERSEDE_SIMILARITY = 0.6
+
+class Bot(discord.AutoShardedClient):
     @classmethod
     async def create(self, *args, allow_dms: bool = False, **kwargs):
-        triager = Triager()
-        await triager.connect()
+        # MCP servers connect in the background once logged in, see setup_hook
+        with STARTUP.phase("agent_graph"):
+            triager = Triager()
 
         return Bot(triager=triager, allow_dms=allow_dms, *args, **kwargs)
 
-    def __init__(self, triager: Triager, allow_dms: bool = False, *args, **kwargs):
+    # In sharded mode, each worker process handles the shards in `shard_ids` (see shard.py)
+    def __init__(self, triager: Triager, allow_dms: bool = False, *args, worker: int = 0, **kwargs):
         super().__init__(*args, **kwargs)
         self._triager = triager
         self._allow_dms = allow_dms
+        self._worker = worker
+        self._state = backend_from_url(CONFIG.STATE_BACKEND_URL)
+        self._dispatcher = Dispatcher(
+            workers=CONFIG.DISPATCH_WORKERS,
+            max_queue=CONFIG.DISPATCH_MAX_QUEUE,
+            per_user_limit=CONFIG.DISPATCH_PER_USER_LIMIT,
+            per_guild_limit=CONFIG.DISPATCH_PER_GUILD_LIMIT,
+            priority_step=CONFIG.DISPATCH_PRIORITY_STEP,
+        )
+        self._history = HistoryStore(
+            max_messages=CONFIG.HISTORY_MAX_MESSAGES,
+            max_channels=CONFIG.HISTORY_MAX_CHANNELS,
+        )
+        self._context = ContextBuilder.for_agent("triage")
+        self._responses = None
+        if CONFIG.RESPONSE_CACHE_SIZE:
+            self._responses = ResponseCache(
+                threshold=CONFIG.RESPONSE_CACHE_THRESHOLD,
+                max_size=CONFIG.RESPONSE_CACHE_SIZE,
+                ttl=CONFIG.RESPONSE_CACHE_TTL,
+                backend=self._state if self._state.shared else None,
+            )
+        # With a shared backend, a thread can move to another process with its session
+        if self._state.shared:
+            self._sessions = StateSessionStore(self._state)
+        else:
+            self._sessions = SessionStore(CONFIG.SESSION_DB_PATH)
+        self._hasher = MinHasher()
+        self._connect_task: asyncio.Task | None = None
+
+    async def setup_hook(self):
+        # Logged in: connect to the gateway without waiting for the MCP servers, the slowest
+        # of which take several seconds. Requests received meanwhile wait in _run_agent.
+        STARTUP.mark("discord_login")
+        self._connect_task = asyncio.create_task(self._connect(), name="mcp-connect")
+        self._dispatcher.start()
+        GOVERNOR.use_backend(self._state)
+
+        METRICS.install(span_log_path=CONFIG.SPAN_LOG_PATH)
+        METRICS.register_gauge("dispatch_queue_depth", self._dispatcher.queue_depth)
+        METRICS.register_gauge("dispatch_running", self._dispatcher.running)
+        METRICS.register_gauge("dispatch_wait_seconds_p50", lambda: self._dispatcher.metrics.wait_percentile(0.50))
+        METRICS.register_gauge("dispatch_wait_seconds_p95", lambda: self._dispatcher.metrics.wait_percentile(0.95))
+        METRICS.register_gauge("dispatch_wait_seconds_max", lambda: self._dispatcher.metrics.wait_time_max)
+        METRICS.register_gauge("router_hit_rate", self._triager.router.hit_rate)
+        METRICS.register_gauge("rate_limit_queued", GOVERNOR.queued)
+        if self._responses is not None:
+            METRICS.register_gauge("response_cache_hit_rate", self._responses.hit_rate)
+            METRICS.register_gauge("response_cache_size", lambda: len(self._responses))
+        if CONFIG.METRICS_PORT:
+            # One port per worker process
+            await METRICS.serve(CONFIG.METRICS_HOST, CONFIG.METRICS_PORT + self._worker)
+
+    async def _connect(self):
+        await self._triager.connect()
+        await self.wait_until_ready()
+        STARTUP.report()
+        for name, duration, _ in STARTUP.phases:
+            METRICS.observe("startup", duration, phase=name)
+
+    async def close(self):
+        if self._connect_task is not None:
+            self._connect_task.cancel()
+        await self._dispatcher.stop()
+        await METRICS.stop()
+        await self._sessions.close()
+        await self._state.close()
+        await super().close()
 
     async def on_ready(self):
-        print(f'We have logged in as {self.user}')
+        if not STARTUP.reported:
+            STARTUP.mark("gateway_ready")
+        print(f'We have logged in as {self.user} (shards {sorted(self.shards)} of {self.shard_count})')
 
     # Dispatch messages based on the channel type
     # async def on_message(self, message):
@@ -58,11 +152,62 @@ class Bot(discord.Client):
     #             "I can only process messages in text channels or threads",
     #         )
 
+    async def on_message_edit(self, before: discord.Message, after: discord.Message):
+        self._history.on_message_edit(after)
+        # Embeds being unfurled trigger edits too
+        if before.content == after.content:
+            return
+        # Answer the edited question instead, unless it was already answered
+        if self._dispatcher.cancel(after.id):
+            print(f"Message {after.id} was edited, answering the new version")
+            await self._dispatch(after)
+
+    async def on_message_delete(self, message: discord.Message):
+        self._history.on_message_delete(message)
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        # Also sent for messages that aren't in discord.py's cache
+        if self._dispatcher.cancel(payload.message_id):
+            print(f"Message {payload.message_id} was deleted, cancelled its processing")
+
     async def on_message(self, message: discord.Message):
+        # Keep the history cache up to date, including our own messages
+        self._history.on_message(message)
+
         # Ignore our own messages
         if message.author == self.user:
             return
 
+        await self._dispatch(message)
+
+    def _priority(self, message: discord.Message) -> int:
+        # Lower runs first: thread follow-ups and short questions go ahead of analyses
+        # that need the sandbox or Dagger Cloud traces
+        if isinstance(message.channel, discord.Thread):
+            return 0
+        if self._triager.router.routes(message.clean_content) & {"sandbox_agent", "cloud_agent"}:
+            return 2
+        if len(message.clean_content) <= SHORT_QUESTION_LENGTH:
+            return 0
+        return 1
+
+    def _supersedes(self, message: discord.Message, message_id: int) -> bool:
+        # Only replies to the earlier question, or near-repeats of it: anything else may be
+        # a separate question, or an addition to the first one
+        if message.id == message_id:
+            return False
+        if message.reference is not None and message.reference.message_id == message_id:
+            return True
+        earlier = self._history.lookup(message.channel.id, message_id)
+        if earlier is None:
+            return False
+        signatures = [
+            self._hasher.signature(shingles(normalize(text)))
+            for text in (earlier.content, message.clean_content)
+        ]
+        return similarity(*signatures) >= SUPERSEDE_SIMILARITY
+
+    async def _dispatch(self, message: discord.Message):
         # Check if it's a DM
         is_dm = isinstance(message.channel, discord.DMChannel)
 
@@ -86,36 +231,83 @@ class Bot(discord.Client):
             )
             return
 
-        query = {
-            "mention": format_message(message),
-        }
-        if message.reference is not None:
-            message_reference = await message.channel.fetch_message(message.reference.message_id)
-            query["reference"] = format_message(message_reference)
+        # A correction of a question still being worked on replaces it
+        if CONFIG.DISPATCH_SUPERSEDE_WINDOW:
+            for superseded in self._dispatcher.supersede(
+                message.channel.id,
+                message.author.id,
+                CONFIG.DISPATCH_SUPERSEDE_WINDOW,
+                match=lambda message_id: self._supersedes(message, message_id),
+            ):
+                print(f"Message {superseded} was superseded by {message.id}, cancelled its processing")
 
-        history = [message async for message in message.channel.history(limit=100)]
-        history = sorted(history, key=lambda message: message.created_at)
-        if history:
-            query["history"] = [format_message(message) for message in history]
+        # Threads keep a session of their own (see on_thread_message)
+        if isinstance(message.channel, discord.Thread):
+            run = lambda: self.on_thread_message(message)
+        else:
+            run = lambda: self.process_channel_message(message)
 
-        print(f"Query: {query}")
+        # Messages in the same channel (or thread) are processed in order, different channels in parallel
+        await self._dispatcher.submit(
+            key=message.channel.id,
+            run=run,
+            user=message.author.id,
+            guild=message.guild.id if message.guild is not None else None,
+            id=message.id,
+            priority=self._priority(message),
+        )
 
+    def _response_cache(self, message: discord.Message) -> ResponseCache | None:
+        # Replies to another message depend on it: only standalone questions are cached
+        if self._responses is None or message.reference is not None:
+            return None
+        if not self._responses.cacheable(message.clean_content):
+            return None
+        return self._responses
+
+    async def process_channel_message(self, message: discord.Message):
         with trace("Processing channel message"):
+            with stage("history_fetch"):
+                reference = None
+                if message.reference is not None:
+                    reference = await self._format_reference(message)
+                history = await self._history.get(message.channel)
+
+            # Answers depend on the conversation they were given with, not just the question
+            responses = self._response_cache(message)
+            conversation = _conversation_key(message, history)
+            if responses is not None:
+                with stage("response_cache"):
+                    cached = await responses.get(message.clean_content, context=conversation)
+                if cached is not None:
+                    METRICS.increment("response_cache_hits")
+                    with stage("discord_reply"):
+                        await StreamingReply(message).finish(cached)
+                    return
+
+            with stage("context_build"):
+                query = self._context.build(
+                    mention=format_message(message),
+                    reference=reference,
+                    history=history,
+                )
+
+            print(f"Query: {query}")
+
+            reply = StreamingReply(message, edit_interval=CONFIG.STREAM_EDIT_INTERVAL)
             async with message.channel.typing():
+                # Collect the MCP write tools called while answering
+                writes = set()
+                token = MCP_WRITES.set(writes)
                 try:
-                    triage_result = await Runner.run(
-                        self._triager.agent,
-                        json.dumps(query),
-                        context=AgentContext(
-                            user=message.author.name,
-                        ),
-                    )
+                    async with self._triager.select_agent(message.clean_content) as agent:
+                        triage_result = await self._run_agent(agent, query, message, reply)
 
                     print(f"> {triage_result.final_output}")
-                    await message.reply(
-                        content=triage_result.final_output,
-                        suppress_embeds=True,
-                    )
+
+                    # Never replay a response that created or modified issues
+                    if responses is not None and not writes:
+                        await responses.put(message.clean_content, str(triage_result.final_output), context=conversation)
 
                     # Create a thread for the response
                     # assert isinstance(triage_result.final_output, SummaryOutput)
@@ -125,48 +317,123 @@ class Bot(discord.Client):
                     #     # reference=message,
                     #     suppress_embeds=True,
                     # )
+                except asyncio.CancelledError:
+                    # The question was edited, deleted or superseded (see _dispatch)
+                    await reply.discard()
+                    raise
                 except Exception as e:
-                    await message.reply(
-                        content=f"Error triaging message: {e}",
-                        suppress_embeds=True,
-                    )
+                    with stage("discord_reply"):
+                        await reply.finish(f"Error triaging message: {e}")
                     raise
+                finally:
+                    MCP_WRITES.reset(token)
+
+    async def _run_agent(self, agent, input, message: discord.Message, reply: StreamingReply):
+        context = AgentContext(
+            user=message.author.name,
+        )
+        with stage("mcp_connect_wait"):
+            await self._triager.wait_connected()
+        if not CONFIG.STREAM_RESPONSES:
+            result = await Runner.run(agent, input, context=context)
+        else:
+            # Post a placeholder right away and edit it as the response comes in
+            with stage("discord_placeholder"):
+                await reply.start()
+            result = Runner.run_streamed(agent, input, context=context)
+            await reply.stream(result)
+        with stage("discord_reply"):
+            await reply.finish(result.final_output)
+        return result
+
+    async def _format_reference(self, message: discord.Message) -> str:
+        # Avoid an API call when the referenced message is already known
+        entry = self._history.lookup(message.channel.id, message.reference.message_id)
+        if entry is not None:
+            return entry.formatted
+        if isinstance(message.reference.resolved, discord.Message):
+            return format_message(message.reference.resolved)
+
+        # Mentions replying to the same message share a single fetch
+        async def fetch():
+            await GOVERNOR.discord("fetch_message", message.channel.id)
+            return await message.channel.fetch_message(message.reference.message_id)
+
+        message_reference = await GOVERNOR.coalesce(("message", message.channel.id, message.reference.message_id), fetch)
+        return format_message(message_reference)
 
     async def on_thread_message(self, message: discord.Message):
         print(f"Processing thread message: {message}")
         starter_message = await get_thread_starter_message(message.channel)
         if starter_message is None:
             print("No starter message found")
+            return await self.process_channel_message(message)
         if starter_message.author != self.user:
+            # Answer mentions in other threads like channel mentions
             print(f"Didn't start the thread: {starter_message.author}")
-            return
+            return await self.process_channel_message(message)
         print("I started this thread")
 
-        history = [message async for message in message.channel.history(limit=100)]
-        history = sorted(history, key=lambda message: message.created_at)
+        with trace("Processing thread message"):
+            with stage("history_fetch"):
+                session = await self._sessions.load(message.channel.id)
+                history = await self._history.get(message.channel)
 
-        inputs = [message_to_input(message, self.user) for message in history]
+            with stage("context_build"):
+                if session is None:
+                    # First turn we know of: start from the Discord history
+                    session = Session(thread_id=message.channel.id, summary=None, last_message_id=0)
+                    new_messages = self._context.pack(history)
+                else:
+                    # Our own replies are already in the session, as run items
+                    new_messages = [
+                        entry for entry in history
+                        if entry.id > session.last_message_id and entry.author_id != self.user.id
+                    ]
+                if not any(entry.id == message.id for entry in new_messages):
+                    new_messages.append(HistoryEntry.from_message(message))
+                delta = [message_to_input(entry, self.user) for entry in new_messages]
+                inputs = session.inputs(delta)
 
-        with trace("Processing thread message"):
+            reply = StreamingReply(message, reference=False, edit_interval=CONFIG.STREAM_EDIT_INTERVAL)
             async with message.channel.typing():
                 try:
-                    triage_result = await Runner.run(
-                        self._triager.agent,
-                        inputs,
-                        context=AgentContext(
-                            user=message.author.name,
-                        ),
-                    )
+                    triage_result = await self._run_agent(self._triager.agent, inputs, message, reply)
 
                     print(f"> {triage_result.final_output}")
-                    await message.channel.send(
-                        content=triage_result.final_output,
-                        # reference=message,
-                        suppress_embeds=True,
-                    )
+                except asyncio.CancelledError:
+                    await reply.discard()
+                    raise
                 except Exception as e:
-                    await message.channel.send(
-                        content=f"Error triaging message: {e}",
-                        reference=message,
-                        suppress_embeds=True,
-                    )
+                    with stage("discord_reply"):
+                        await reply.finish(f"Error triaging message: {e}")
+                    return
+
+            # Keep the tool calls and their outputs for the next turns
+            with stage("session_save"):
+                items = delta + [item.to_input_item() for item in triage_result.new_items]
+                await self._sessions.append(session.thread_id, items, last_message_id=max(message.id, session.last_message_id))
+            await self._compact_session(session.thread_id)
+
+    async def _compact_session(self, thread_id: int):
+        session = await self._sessions.load(thread_id)
+        if session is None or session.tokens <= CONFIG.SESSION_COMPACT_TOKENS:
+            return
+        before_seq = session.compaction_point(keep=CONFIG.SESSION_KEEP_ITEMS)
+        if before_seq is None:
+            return
+
+        with stage("session_compact"):
+            # The previous summary is part of the input: summaries roll over
+            compacted = Session(
+                thread_id=thread_id,
+                summary=session.summary,
+                last_message_id=session.last_message_id,
+                items=[(seq, item) for seq, item in session.items if seq < before_seq],
+            )
+            inputs = compacted.inputs([{
+                "content": "Summarize the conversation above, keeping the facts, decisions, tool results and open questions needed to continue it.",
+                "role": "user",
+            }])
+            result = await Runner.run(self._triager.summary_agent, inputs, context=AgentContext())
+            await self._sessions.compact(thread_id, result.final_output.summary, before_seq)
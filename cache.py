@@ -0,0 +1,179 @@
+import json
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Callable, Generic, Hashable, Iterable, TypeVar
+
+from agents.mcp import MCPServer
+from mcp.types import CallToolResult, Tool as MCPTool
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """LRU cache whose entries also expire `ttl` seconds after being stored."""
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300, on_evict: Callable[[Hashable], None] | None = None):
+        self._max_size = max_size
+        self._ttl = ttl
+        # Called with the key of entries that expired or were evicted
+        self._on_evict = on_evict
+        self._entries: OrderedDict[Hashable, tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> V | None:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            if self._on_evict is not None:
+                self._on_evict(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: V):
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_size:
+            evicted, _ = self._entries.popitem(last=False)
+            if self._on_evict is not None:
+                self._on_evict(evicted)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def keys(self) -> Iterable[Hashable]:
+        return list(self._entries.keys())
+
+    def clear(self):
+        self._entries.clear()
+
+
+# Set to a fresh set at the start of a request to collect the write tools it called
+MCP_WRITES: ContextVar[set[str] | None] = ContextVar("MCP_WRITES", default=None)
+
+
+# Read-only MCP tools whose results can be cached
+GITHUB_READ_ONLY_TOOLS = {
+    "get_me",
+    "get_issue",
+    "get_issue_comments",
+    "list_issues",
+    "search_issues",
+    "get_pull_request",
+    "get_pull_request_files",
+    "get_pull_request_comments",
+    "get_pull_request_reviews",
+    "get_pull_request_status",
+    "list_pull_requests",
+    "get_commit",
+    "list_commits",
+    "list_branches",
+    "get_file_contents",
+    "search_code",
+    "search_repositories",
+    "search_users",
+}
+
+NOTION_READ_ONLY_TOOLS = {
+    "API-get-self",
+    "API-get-user",
+    "API-get-users",
+    "API-post-search",
+    "API-retrieve-a-page",
+    "API-retrieve-a-page-property",
+    "API-retrieve-a-block",
+    "API-get-block-children",
+    "API-retrieve-a-database",
+    "API-retrieve-a-comment",
+}
+
+# Arguments identifying the resource a tool call is about. A write invalidates every cached
+# call that doesn't target a different resource.
+_SCOPE_ARGUMENTS = {
+    "owner",
+    "repo",
+    "issue_number",
+    "pullNumber",
+    "pull_number",
+    "page_id",
+    "block_id",
+    "database_id",
+}
+
+
+def _related(write_arguments: dict[str, Any], cached_arguments: dict[str, Any]) -> bool:
+    for key in _SCOPE_ARGUMENTS:
+        if key in write_arguments and key in cached_arguments and write_arguments[key] != cached_arguments[key]:
+            return False
+    return True
+
+
+class CachedMCPServer(MCPServer):
+    """
+    Wraps an MCP server with a process-lifetime cache of its tool listing, and a TTL+LRU
+    read-through cache for the tools in `read_only_tools`. Any other tool call is treated as
+    a write and invalidates the related cached calls.
+    """
+
+    def __init__(self, server: MCPServer, read_only_tools: set[str], max_size: int = 1024, ttl: float = 300):
+        self.server = server
+        self._read_only_tools = read_only_tools
+        self._tools: list[MCPTool] | None = None
+        self._calls: TTLCache[CallToolResult] = TTLCache(max_size=max_size, ttl=ttl)
+
+    @property
+    def name(self) -> str:
+        return self.server.name
+
+    @property
+    def session(self):
+        # Used by the supervisor for health checks
+        return getattr(self.server, "session", None)
+
+    async def connect(self):
+        await self.server.connect()
+
+    async def cleanup(self):
+        await self.server.cleanup()
+
+    async def list_tools(self) -> list[MCPTool]:
+        if self._tools is None:
+            self._tools = await self.server.list_tools()
+        return self._tools
+
+    async def call_tool(self, tool_name: str, arguments: dict[str, Any] | None) -> CallToolResult:
+        arguments = arguments or {}
+        if tool_name not in self._read_only_tools:
+            writes = MCP_WRITES.get()
+            if writes is not None:
+                writes.add(tool_name)
+            result = await self.server.call_tool(tool_name, arguments)
+            self._invalidate(arguments)
+            return result
+
+        key = (tool_name, json.dumps(arguments, sort_keys=True))
+        result = self._calls.get(key)
+        if result is not None:
+            return result
+
+        result = await self.server.call_tool(tool_name, arguments)
+        if not result.isError:
+            self._calls.set(key, result)
+        return result
+
+    def _invalidate(self, arguments: dict[str, Any]):
+        for key in self._calls.keys():
+            _, cached_arguments = key
+            if _related(arguments, json.loads(cached_arguments)):
+                self._calls.delete(key)
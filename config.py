@@ -1,4 +1,4 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import List
 
 @dataclass
@@ -10,12 +10,124 @@ class AgentConfig:
     GITHUB_REPO: str
     DAGGER_CLOUD_TOKEN: str
 
+    # Models: agents with the "auto" policy run on the small model unless their input is
+    # large or it's slow, and are retried on the large model when the output is invalid
+    MODEL_LARGE: str = "gpt-4.1"
+    MODEL_SMALL: str = "gpt-4.1-mini"
+    MODEL_POLICIES: dict[str, str] = field(default_factory=lambda: {"triage": "auto", "summary": "auto"})
+    MODEL_SMALL_MAX_TOKENS: int = 4000
+    MODEL_LATENCY_TARGET: float = 10
+    # Latency samples older than this many seconds are forgotten
+    MODEL_LATENCY_WINDOW: float = 600
+    # Share of "auto" calls sent to the other model, so that both keep being measured
+    MODEL_EXPLORE_RATE: float = 0.05
+    MODEL_DECISION_LOG_PATH: str | None = None
+
+    # Message dispatch
+    DISPATCH_WORKERS: int = 4
+    DISPATCH_MAX_QUEUE: int = 100
+    DISPATCH_PER_USER_LIMIT: int = 1
+    DISPATCH_PER_GUILD_LIMIT: int = 4
+    # Seconds of extra queueing per priority level (see Bot._priority)
+    DISPATCH_PRIORITY_STEP: float = 30
+    # A new mention replying to, or nearly repeating, one of the same user's mentions in the
+    # channel from the last N seconds cancels it (see Bot._supersedes), 0 disables
+    DISPATCH_SUPERSEDE_WINDOW: float = 60
+
+    # Channel history cache
+    HISTORY_MAX_MESSAGES: int = 100
+    HISTORY_MAX_CHANNELS: int = 256
+
+    # Token budget of the context sent to an agent, with per-agent overrides
+    CONTEXT_TOKEN_BUDGET: int = 4000
+    CONTEXT_TOKEN_BUDGETS: dict[str, int] = field(default_factory=dict)
+
+    # MCP server supervision
+    MCP_HEALTH_CHECK_INTERVAL: float = 30
+    MCP_RECONNECT_BACKOFF_MAX: float = 60
+    # Servers started on first use and stopped after MCP_IDLE_TIMEOUT seconds without use
+    MCP_LAZY_SERVERS: list[str] = field(default_factory=lambda: ["notion", "sandbox"])
+    MCP_IDLE_TIMEOUT: float = 300
+
+    # Read-through cache of read-only MCP tool calls
+    MCP_TOOL_CACHE_SIZE: int = 1024
+    MCP_TOOL_CACHE_TTL: float = 300
+
+    # Stream responses to Discord, editing the reply at most once per interval
+    STREAM_RESPONSES: bool = True
+    STREAM_EDIT_INTERVAL: float = 1.0
+
+    # Semantic cache of responses to mentions, disabled when the size is 0
+    RESPONSE_CACHE_SIZE: int = 512
+    RESPONSE_CACHE_TTL: float = 3600
+    RESPONSE_CACHE_THRESHOLD: float = 0.85
+
+    # Thread conversations, compacted into a summary past SESSION_COMPACT_TOKENS,
+    # keeping at least the last SESSION_KEEP_ITEMS run items
+    # (SQLite database, unless STATE_BACKEND_URL is shared)
+    SESSION_DB_PATH: str = "sessions.db"
+    SESSION_COMPACT_TOKENS: int = 8000
+    SESSION_KEEP_ITEMS: int = 10
+
+    # State shared between processes: memory:// (single process) or redis://host:port/db
+    STATE_BACKEND_URL: str = "memory://"
+
+    # Rate limits: Discord requests per second, and per channel and route per window;
+    # OpenAI requests and tokens per minute (0 for no limit). Work past a limit is queued.
+    DISCORD_GLOBAL_RATE: int = 50
+    DISCORD_ROUTE_RATE: int = 5
+    DISCORD_ROUTE_WINDOW: float = 5
+    OPENAI_RPM: int = 0
+    OPENAI_TPM: int = 0
+
+    # Dagger Cloud MCP tool returning the spans of a trace, and the on-disk cache of traces.
+    # Running traces are refetched after TRACE_CACHE_TTL seconds.
+    CLOUD_TRACE_TOOL: str = "get_trace"
+    TRACE_CACHE_DIR: str = ".trace-cache"
+    TRACE_CACHE_TTL: float = 300
+
+    # Local search index over the docs and issues, built with main.py --build-index
+    SEARCH_INDEX_DIR: str = ".search-index"
+
+    # Local index of open and recently updated issues, refreshed in the background
+    ISSUE_INDEX_PATH: str = ".issue-index.json"
+    ISSUE_INDEX_REFRESH_INTERVAL: float = 600
+    ISSUE_INDEX_MAX_AGE_DAYS: int = 180
+
+    # Pull the sandbox images at startup
+    SANDBOX_PREWARM: bool = False
+
+    # Prometheus metrics endpoint (disabled when the port is 0) and JSONL span log
+    METRICS_HOST: str = "127.0.0.1"
+    METRICS_PORT: int = 0
+    SPAN_LOG_PATH: str | None = None
+
 # Load from environment variables
 import os
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def _parse_budgets(value: str) -> dict[str, int]:
+    # "triage=4000,summary=16000"
+    budgets = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        agent, tokens = item.split("=", 1)
+        budgets[agent.strip()] = int(tokens)
+    return budgets
+
+def _parse_policies(value: str) -> dict[str, str]:
+    # "triage=auto,summary=auto,issue=large"
+    policies = {}
+    for item in value.split(","):
+        if not item.strip():
+            continue
+        agent, policy = item.split("=", 1)
+        policies[agent.strip()] = policy.strip()
+    return policies
+
 CONFIG = AgentConfig(
     OPENAI_API_KEY=os.getenv("OPENAI_API_KEY"),
     DISCORD_TOKEN=os.getenv("DISCORD_TOKEN"),
@@ -23,4 +135,54 @@ CONFIG = AgentConfig(
     NOTION_TOKEN=os.getenv("NOTION_TOKEN"),
     GITHUB_REPO=os.getenv("GITHUB_REPO", "dagger/dagger"),
     DAGGER_CLOUD_TOKEN=os.getenv("DAGGER_CLOUD_TOKEN"),
+    MODEL_LARGE=os.getenv("MODEL_LARGE", "gpt-4.1"),
+    MODEL_SMALL=os.getenv("MODEL_SMALL", "gpt-4.1-mini"),
+    MODEL_POLICIES=_parse_policies(os.getenv("MODEL_POLICIES", "triage=auto,summary=auto")),
+    MODEL_SMALL_MAX_TOKENS=int(os.getenv("MODEL_SMALL_MAX_TOKENS", "4000")),
+    MODEL_LATENCY_TARGET=float(os.getenv("MODEL_LATENCY_TARGET", "10")),
+    MODEL_LATENCY_WINDOW=float(os.getenv("MODEL_LATENCY_WINDOW", "600")),
+    MODEL_EXPLORE_RATE=float(os.getenv("MODEL_EXPLORE_RATE", "0.05")),
+    MODEL_DECISION_LOG_PATH=os.getenv("MODEL_DECISION_LOG_PATH"),
+    DISPATCH_WORKERS=int(os.getenv("DISPATCH_WORKERS", "4")),
+    DISPATCH_MAX_QUEUE=int(os.getenv("DISPATCH_MAX_QUEUE", "100")),
+    DISPATCH_PER_USER_LIMIT=int(os.getenv("DISPATCH_PER_USER_LIMIT", "1")),
+    DISPATCH_PER_GUILD_LIMIT=int(os.getenv("DISPATCH_PER_GUILD_LIMIT", "4")),
+    DISPATCH_PRIORITY_STEP=float(os.getenv("DISPATCH_PRIORITY_STEP", "30")),
+    DISPATCH_SUPERSEDE_WINDOW=float(os.getenv("DISPATCH_SUPERSEDE_WINDOW", "60")),
+    HISTORY_MAX_MESSAGES=int(os.getenv("HISTORY_MAX_MESSAGES", "100")),
+    HISTORY_MAX_CHANNELS=int(os.getenv("HISTORY_MAX_CHANNELS", "256")),
+    CONTEXT_TOKEN_BUDGET=int(os.getenv("CONTEXT_TOKEN_BUDGET", "4000")),
+    # Summaries need whole conversations
+    CONTEXT_TOKEN_BUDGETS=_parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", "summary=16000")),
+    MCP_HEALTH_CHECK_INTERVAL=float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30")),
+    MCP_RECONNECT_BACKOFF_MAX=float(os.getenv("MCP_RECONNECT_BACKOFF_MAX", "60")),
+    MCP_LAZY_SERVERS=[name.strip() for name in os.getenv("MCP_LAZY_SERVERS", "notion,sandbox").split(",") if name.strip()],
+    MCP_IDLE_TIMEOUT=float(os.getenv("MCP_IDLE_TIMEOUT", "300")),
+    MCP_TOOL_CACHE_SIZE=int(os.getenv("MCP_TOOL_CACHE_SIZE", "1024")),
+    MCP_TOOL_CACHE_TTL=float(os.getenv("MCP_TOOL_CACHE_TTL", "300")),
+    STREAM_RESPONSES=os.getenv("STREAM_RESPONSES", "true").lower() in ("1", "true", "yes"),
+    STREAM_EDIT_INTERVAL=float(os.getenv("STREAM_EDIT_INTERVAL", "1.0")),
+    RESPONSE_CACHE_SIZE=int(os.getenv("RESPONSE_CACHE_SIZE", "512")),
+    RESPONSE_CACHE_TTL=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    RESPONSE_CACHE_THRESHOLD=float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.85")),
+    SESSION_DB_PATH=os.getenv("SESSION_DB_PATH", "sessions.db"),
+    SESSION_COMPACT_TOKENS=int(os.getenv("SESSION_COMPACT_TOKENS", "8000")),
+    SESSION_KEEP_ITEMS=int(os.getenv("SESSION_KEEP_ITEMS", "10")),
+    STATE_BACKEND_URL=os.getenv("STATE_BACKEND_URL", "memory://"),
+    DISCORD_GLOBAL_RATE=int(os.getenv("DISCORD_GLOBAL_RATE", "50")),
+    DISCORD_ROUTE_RATE=int(os.getenv("DISCORD_ROUTE_RATE", "5")),
+    DISCORD_ROUTE_WINDOW=float(os.getenv("DISCORD_ROUTE_WINDOW", "5")),
+    OPENAI_RPM=int(os.getenv("OPENAI_RPM", "0")),
+    OPENAI_TPM=int(os.getenv("OPENAI_TPM", "0")),
+    CLOUD_TRACE_TOOL=os.getenv("CLOUD_TRACE_TOOL", "get_trace"),
+    TRACE_CACHE_DIR=os.getenv("TRACE_CACHE_DIR", ".trace-cache"),
+    TRACE_CACHE_TTL=float(os.getenv("TRACE_CACHE_TTL", "300")),
+    SEARCH_INDEX_DIR=os.getenv("SEARCH_INDEX_DIR", ".search-index"),
+    ISSUE_INDEX_PATH=os.getenv("ISSUE_INDEX_PATH", ".issue-index.json"),
+    ISSUE_INDEX_REFRESH_INTERVAL=float(os.getenv("ISSUE_INDEX_REFRESH_INTERVAL", "600")),
+    ISSUE_INDEX_MAX_AGE_DAYS=int(os.getenv("ISSUE_INDEX_MAX_AGE_DAYS", "180")),
+    SANDBOX_PREWARM=os.getenv("SANDBOX_PREWARM", "false").lower() in ("1", "true", "yes"),
+    METRICS_HOST=os.getenv("METRICS_HOST", "127.0.0.1"),
+    METRICS_PORT=int(os.getenv("METRICS_PORT", "0")),
+    SPAN_LOG_PATH=os.getenv("SPAN_LOG_PATH"),
 )
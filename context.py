@@ -0,0 +1,85 @@
+from typing import Iterable
+
+from config import CONFIG
+from history import HistoryEntry
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token budgets are approximate by design. By default tokens are estimated at 4 characters
+# each, close enough for English text and with nothing to download. Installing tiktoken makes
+# counts exact; its encoding file is downloaded on first use unless TIKTOKEN_CACHE_DIR points
+# to a directory holding it, and counting falls back to the estimate if that fails.
+_encoding = None
+_estimate = tiktoken is None
+
+def count_tokens(text: str) -> int:
+    global _encoding, _estimate
+    if not _estimate and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception as e:
+            print(f"Failed to load the o200k_base encoding, estimating token counts instead: {e}")
+            _estimate = True
+    if _estimate:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+def entry_tokens(entry: HistoryEntry) -> int:
+    if entry.tokens is None:
+        entry.tokens = count_tokens(entry.formatted)
+    return entry.tokens
+
+class ContextBuilder:
+    """
+    Assembles the query sent to an agent from pre-serialized messages.
+
+    History is packed newest-first until the token budget is exhausted, then emitted in
+    chronological order. The first `keep_first` entries, e.g. the question a conversation
+    started with, are kept regardless. The query is produced by joining the serialized messages, so each
+    message is JSON-encoded exactly once.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+
+    @classmethod
+    def for_agent(cls, agent: str) -> "ContextBuilder":
+        return cls(CONFIG.CONTEXT_TOKEN_BUDGETS.get(agent, CONFIG.CONTEXT_TOKEN_BUDGET))
+
+    def pack(self, history: Iterable[HistoryEntry], reserved: int = 0, keep_first: int = 0) -> list[HistoryEntry]:
+        history = list(history)
+        first = history[:keep_first]
+        remaining = self.budget - reserved - sum(entry_tokens(entry) for entry in first)
+        packed = []
+        for entry in reversed(history[keep_first:]):
+            tokens = entry_tokens(entry)
+            if tokens > remaining:
+                break
+            remaining -= tokens
+            packed.append(entry)
+        packed.reverse()
+        return first + packed
+
+    def build(
+        self,
+        mention: str,
+        reference: str | None = None,
+        history: Iterable[HistoryEntry] = (),
+        keep_first: int = 0,
+    ) -> str:
+        parts = [f'"mention": {mention}']
+        reserved = count_tokens(mention)
+        if reference is not None:
+            parts.append(f'"reference": {reference}')
+            reserved += count_tokens(reference)
+
+        # The mention is usually the newest history entry, don't send it twice
+        history = [entry for entry in history if entry.formatted != mention]
+        packed = self.pack(history, reserved=reserved, keep_first=keep_first)
+        if packed:
+            parts.append(f'"history": [{", ".join(entry.formatted for entry in packed)}]')
+
+        return "{" + ", ".join(parts) + "}"
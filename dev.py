@@ -2,14 +2,18 @@ import json
 from datetime import datetime
 
 from agent import AgentContext, Triager
-from agents import Runner, trace
+from agents import ModelProvider, RunConfig, Runner, trace
+from agents.mcp import MCPServer
+from context import ContextBuilder
+from metrics import stage
+from startup import STARTUP
 
 
 class MockUser:
     def __init__(self):
         self.name = "test"
 
-def format_message(message: str) -> dict:
+def format_message(message: str) -> str:
     return json.dumps({
         "user": "test",
         "created_at": datetime.now().isoformat(),
@@ -18,15 +22,19 @@ def format_message(message: str) -> dict:
 
 class MockBot:
     @classmethod
-    async def create(self, *args, **kwargs):
-        triager = Triager()
+    async def create(self, *args, servers: dict[str, MCPServer] | None = None, model_provider: ModelProvider | None = None, **kwargs):
+        with STARTUP.phase("agent_graph"):
+            triager = Triager(servers=servers, model_provider=model_provider)
         await triager.connect()
+        STARTUP.report()
         return MockBot(triager=triager, *args, **kwargs)
 
-    def __init__(self, triager: Triager, *args, **kwargs):
+    def __init__(self, triager: Triager, *args, run_config: RunConfig | None = None, **kwargs):
         super().__init__(*args, **kwargs)
         self._triager = triager
+        self._run_config = run_config
         self.user = MockUser()
+        self._context = ContextBuilder.for_agent("triage")
 
     async def on_ready(self):
         print(f'We have logged in as {self.user}')
@@ -34,21 +42,41 @@ class MockBot:
     async def on_message(self, message: str):
         print(f"Processing message: {message}")
 
-        query = {
-            "mention": format_message(message),
-        }
         # TODO: add "reference" and "history" keys
         # potentially load discord history from a file
-
-        triage_result = await Runner.run(
-            self._triager.agent,
-            json.dumps(query),
-            context=AgentContext(
-                user=self.user.name,
-            ),
+        query = self._context.build(
+            mention=format_message(message),
         )
 
+        triage_result = await self._run(message, query)
+
         print(f"> {triage_result.final_output}")
+        print(f"Router hit rate: {self._triager.router.hit_rate():.0%} {self._triager.router.hits}")
+
+    async def on_conversation(self, conversation):
+        # Replays a recorded conversation (see benchmark.py)
+        with trace("Processing recorded conversation"):
+            with stage("context_build"):
+                query = self._context.build(
+                    mention=conversation.mention,
+                    reference=conversation.reference,
+                    history=conversation.history,
+                )
+            return await self._run(conversation.text, query)
+
+    async def _run(self, message: str, query: str):
+        async with self._triager.select_agent(message) as agent:
+            return await Runner.run(
+                agent,
+                query,
+                context=AgentContext(
+                    user=self.user.name,
+                ),
+                run_config=self._run_config,
+            )
+
+    async def cleanup(self):
+        await self._triager.cleanup()
 
     async def start(self):        
         await self.on_ready()
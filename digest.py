@@ -0,0 +1,152 @@
+import asyncio
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+
+import discord
+from agents import Agent, Runner, trace
+
+from agent import AgentContext, SummaryOutput, _summary_agent
+from config import CONFIG
+from context import ContextBuilder
+from governor import GOVERNOR
+from history import HistoryEntry
+from models import ModelSelector
+
+
+@dataclass
+class Segment:
+    """A conversation: messages linked by replies, or close in time."""
+    entries: list[HistoryEntry] = field(default_factory=list)
+
+    @property
+    def id(self) -> int:
+        return self.entries[0].id
+
+    @property
+    def last(self) -> HistoryEntry:
+        return self.entries[-1]
+
+
+def segment(messages: list[tuple[HistoryEntry, int | None]], gap: timedelta) -> list[Segment]:
+    """
+    Splits chronological (entry, replied-to message ID) pairs into conversations. A reply
+    joins the conversation of the message it replies to; other messages join the latest
+    conversation unless it's been quiet for longer than `gap`.
+    """
+    segments: list[Segment] = []
+    by_message: dict[int, Segment] = {}
+    for entry, reply_to in messages:
+        target = by_message.get(reply_to) if reply_to is not None else None
+        if target is None and segments and entry.created_at - segments[-1].last.created_at <= gap:
+            target = segments[-1]
+        if target is None:
+            target = Segment()
+            segments.append(target)
+        target.entries.append(entry)
+        by_message[entry.id] = target
+    return segments
+
+
+def _checkpoint(path: str) -> dict[int, dict]:
+    done = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    result = json.loads(line)
+                    done[result["segment_id"]] = result
+    return done
+
+
+async def scan(channel: discord.abc.Messageable, since: datetime) -> list[tuple[HistoryEntry, int | None]]:
+    messages = []
+    i = 0
+    async for message in channel.history(limit=None, after=since, oldest_first=True):
+        # The history endpoint returns 100 messages per request
+        if i % 100 == 0:
+            await GOVERNOR.discord("history", channel.id)
+        i += 1
+        if message.author.bot or not message.clean_content.strip():
+            continue
+        reply_to = message.reference.message_id if message.reference is not None else None
+        messages.append((HistoryEntry.from_message(message), reply_to))
+    return messages
+
+
+async def summarize(
+    agent: Agent[AgentContext],
+    segments: list[Segment],
+    output: str,
+    concurrency: int = 8,
+    min_messages: int = 3,
+) -> int:
+    """
+    Summarizes conversations concurrently, appending each result to `output` (JSON lines) as
+    soon as it's ready. Conversations already in `output` are skipped, so an interrupted run
+    resumes where it stopped. Returns the number of conversations summarized.
+    """
+    done = _checkpoint(output)
+    pending = [segment for segment in segments if len(segment.entries) >= min_messages and segment.id not in done]
+    print(f"{len(segments)} conversations, {len(done)} already summarized, {len(pending)} to summarize")
+
+    context = ContextBuilder.for_agent("summary")
+    semaphore = asyncio.Semaphore(concurrency)
+    lock = asyncio.Lock()
+    summarized = 0
+
+    async def one(segment: Segment):
+        nonlocal summarized
+        query = context.build(
+            mention=json.dumps({"message": "Summarize this conversation and give it a thread title."}),
+            history=segment.entries,
+            # The question the conversation started with, even when the rest doesn't fit
+            keep_first=1,
+        )
+        async with semaphore:
+            try:
+                with trace("Summarizing conversation"):
+                    result = await Runner.run(agent, query, context=AgentContext())
+            except Exception as e:
+                print(f"Failed to summarize conversation {segment.id}: {e}")
+                return
+        assert isinstance(result.final_output, SummaryOutput)
+        async with lock:
+            with open(output, "a") as f:
+                f.write(json.dumps({
+                    "segment_id": segment.id,
+                    "last_message_id": segment.last.id,
+                    "started_at": segment.entries[0].created_at.isoformat(),
+                    "messages": len(segment.entries),
+                    "title": result.final_output.title,
+                    "summary": result.final_output.summary,
+                }) + "\n")
+            summarized += 1
+
+    await asyncio.gather(*[one(segment) for segment in pending])
+    return summarized
+
+
+async def digest(
+    channel_id: int,
+    hours: float,
+    output: str,
+    gap_minutes: float = 30,
+    concurrency: int = 8,
+    min_messages: int = 3,
+):
+    """Summarizes the conversations of a channel's last `hours` hours into `output`."""
+    client = discord.Client(intents=discord.Intents.default())
+    # Only the REST API is needed, no gateway connection
+    await client.login(CONFIG.DISCORD_TOKEN)
+    try:
+        channel = await client.fetch_channel(channel_id)
+        since = datetime.now(timezone.utc) - timedelta(hours=hours)
+        messages = await scan(channel, since)
+        segments = segment(messages, gap=timedelta(minutes=gap_minutes))
+        agent = _summary_agent(ModelSelector.from_config().model("summary"))
+        summarized = await summarize(agent, segments, output, concurrency=concurrency, min_messages=min_messages)
+        print(f"Summarized {summarized} conversations from {len(messages)} messages into {output}")
+    finally:
+        await client.close()
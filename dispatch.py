@@ -0,0 +1,262 @@
+import asyncio
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Hashable
+
+
+@dataclass
+class Job:
+    key: Hashable
+    user: Hashable | None
+    guild: Hashable | None
+    run: Callable[[], Awaitable[None]]
+    # Identifies the job for cancellation, e.g. the ID of the message it answers
+    id: Hashable | None = None
+    # Lower runs first, see Dispatcher
+    priority: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    task: asyncio.Task | None = None
+    cancelled: bool = False
+
+
+@dataclass
+class DispatcherMetrics:
+    submitted: int = 0
+    completed: int = 0
+    failed: int = 0
+    cancelled: int = 0
+    wait_time_total: float = 0.0
+    wait_time_max: float = 0.0
+    # Most recent wait times, used to compute percentiles
+    wait_times: deque = field(default_factory=lambda: deque(maxlen=1000))
+
+    def record_wait(self, wait: float):
+        self.wait_time_total += wait
+        self.wait_time_max = max(self.wait_time_max, wait)
+        self.wait_times.append(wait)
+
+    def wait_percentile(self, p: float) -> float:
+        if not self.wait_times:
+            return 0.0
+        ordered = sorted(self.wait_times)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class Dispatcher:
+    """
+    Bounded work queue served by a pool of workers.
+
+    Jobs sharing the same key (a channel or thread) run one at a time in submission order,
+    while different keys run in parallel. Keys are served round-robin so that a busy
+    channel can't starve the others. A job only starts once its user and guild are below
+    their concurrency limits; until then its channel is parked.
+
+    Channels are picked by the priority of their next job: each priority level counts as
+    `priority_step` seconds of extra wait, so urgent jobs go first but low priority ones
+    aren't starved. Jobs submitted with an ID can be cancelled, whether queued or running.
+    """
+
+    def __init__(
+        self,
+        workers: int = 4,
+        max_queue: int = 100,
+        per_user_limit: int = 1,
+        per_guild_limit: int = 4,
+        priority_step: float = 30,
+    ):
+        self._workers = workers
+        self._per_user_limit = per_user_limit
+        self._per_guild_limit = per_guild_limit
+        self._priority_step = priority_step
+
+        # Backpressure: submitters wait for a slot once max_queue jobs are pending
+        self._slots = asyncio.Semaphore(max_queue)
+        self._lanes: dict[Hashable, deque[Job]] = {}
+        # Keys with pending jobs that are not currently being served, by rank
+        self._ready: asyncio.PriorityQueue[tuple[float, int, Hashable]] = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        # Queued and running jobs by ID
+        self._jobs: dict[Hashable, Job] = {}
+        # Keys whose head job is waiting on a user or guild limit
+        self._parked: list[Hashable] = []
+        self._active_users: dict[Hashable, int] = {}
+        self._active_guilds: dict[Hashable, int] = {}
+        self._running = 0
+        self._tasks: list[asyncio.Task] = []
+        self._stopping = False
+        self.metrics = DispatcherMetrics()
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"dispatch-worker-{i}")
+            for i in range(self._workers)
+        ]
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(
+        self,
+        key: Hashable,
+        run: Callable[[], Awaitable[None]],
+        user: Hashable | None = None,
+        guild: Hashable | None = None,
+        id: Hashable | None = None,
+        priority: int = 0,
+    ):
+        await self._slots.acquire()
+        job = Job(key=key, user=user, guild=guild, run=run, id=id, priority=priority)
+        self.metrics.submitted += 1
+        if id is not None:
+            self._jobs[id] = job
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            # New (or idle) lane: schedule it
+            self._lanes[key] = deque([job])
+            self._schedule(key)
+        else:
+            # The lane is either queued, parked or being served; it will be picked up
+            lane.append(job)
+
+    def cancel(self, id: Hashable) -> bool:
+        """Cancels a queued or running job. Returns whether there was one."""
+        job = self._jobs.get(id)
+        if job is None:
+            return False
+        job.cancelled = True
+        if job.task is not None:
+            # The worker accounts for it once the task is done
+            job.task.cancel()
+            return True
+
+        # Left in place if it empties the lane, workers drop empty lanes
+        self._lanes[job.key].remove(job)
+        del self._jobs[id]
+        self._slots.release()
+        self.metrics.cancelled += 1
+        return True
+
+    def supersede(
+        self,
+        key: Hashable,
+        user: Hashable,
+        window: float,
+        match: Callable[[Hashable], bool],
+    ) -> list[Hashable]:
+        """
+        Cancels the jobs of `user` on `key` submitted in the last `window` seconds whose ID
+        `match` accepts. Returns their IDs.
+        """
+        now = time.monotonic()
+        superseded = [
+            id for id, job in self._jobs.items()
+            if job.key == key and job.user == user and now - job.enqueued_at <= window and match(id)
+        ]
+        for id in superseded:
+            self.cancel(id)
+        return superseded
+
+    def _schedule(self, key: Hashable):
+        lane = self._lanes[key]
+        rank = time.monotonic() + (lane[0].priority * self._priority_step if lane else 0)
+        self._ready.put_nowait((rank, next(self._sequence), key))
+
+    def running(self) -> int:
+        return self._running
+
+    def queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    def snapshot(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "running": self._running,
+            "channels": len(self._lanes),
+            "parked_channels": len(self._parked),
+            "submitted": self.metrics.submitted,
+            "completed": self.metrics.completed,
+            "failed": self.metrics.failed,
+            "cancelled": self.metrics.cancelled,
+            "wait_time_max": self.metrics.wait_time_max,
+            "wait_time_p50": self.metrics.wait_percentile(0.50),
+            "wait_time_p95": self.metrics.wait_percentile(0.95),
+        }
+
+    def _can_start(self, job: Job) -> bool:
+        if job.user is not None and self._active_users.get(job.user, 0) >= self._per_user_limit:
+            return False
+        if job.guild is not None and self._active_guilds.get(job.guild, 0) >= self._per_guild_limit:
+            return False
+        return True
+
+    def _acquire(self, job: Job):
+        if job.user is not None:
+            self._active_users[job.user] = self._active_users.get(job.user, 0) + 1
+        if job.guild is not None:
+            self._active_guilds[job.guild] = self._active_guilds.get(job.guild, 0) + 1
+
+    def _release(self, job: Job):
+        for active, owner in ((self._active_users, job.user), (self._active_guilds, job.guild)):
+            if owner is None:
+                continue
+            active[owner] -= 1
+            if active[owner] <= 0:
+                del active[owner]
+
+        # Limits changed: give parked lanes another chance
+        for key in self._parked:
+            self._schedule(key)
+        self._parked.clear()
+
+    async def _worker(self):
+        while True:
+            _, _, key = await self._ready.get()
+            lane = self._lanes[key]
+            if not lane:
+                # Its jobs were all cancelled while it was waiting
+                del self._lanes[key]
+                continue
+            job = lane[0]
+
+            if not self._can_start(job):
+                self._parked.append(key)
+                continue
+
+            lane.popleft()
+            self._acquire(job)
+            self._running += 1
+            self.metrics.record_wait(time.monotonic() - job.enqueued_at)
+            # Run in a task of its own, so that it can be cancelled without the worker
+            job.task = asyncio.create_task(job.run())
+            try:
+                await job.task
+                self.metrics.completed += 1
+            except asyncio.CancelledError:
+                if self._stopping or not job.cancelled:
+                    raise
+                self.metrics.cancelled += 1
+                print(f"Dispatch job for {key} cancelled")
+            except Exception as e:
+                self.metrics.failed += 1
+                print(f"Dispatch job for {key} failed: {e}")
+            finally:
+                self._running -= 1
+                # The ID may already belong to a resubmitted job, e.g. for an edited message
+                if job.id is not None and self._jobs.get(job.id) is job:
+                    del self._jobs[job.id]
+                self._release(job)
+                self._slots.release()
+                if lane:
+                    # Back of the line so other channels get a turn
+                    self._schedule(key)
+                else:
+                    del self._lanes[key]
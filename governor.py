@@ -0,0 +1,128 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from config import CONFIG
+from metrics import METRICS
+from state import MemoryBackend, StateBackend
+
+T = TypeVar("T")
+
+
+class RateGovernor:
+    """
+    Shared view of the rate limits of the APIs the bot calls: Discord's global limit and
+    per-channel route buckets, and OpenAI's requests and tokens per minute.
+
+    Callers `await` the relevant bucket before making a request: work past a limit is queued
+    until the next window rather than failed. Counters live in the state backend, so
+    processes sharing a backend share their limits. While a shared backend is unreachable,
+    each process falls back to counting on its own.
+
+    Identical in-flight fetches (the same referenced message, the same channel history) can
+    be coalesced into a single request with `coalesce`.
+    """
+
+    def __init__(
+        self,
+        backend: StateBackend | None = None,
+        discord_global: int = 50,
+        discord_route: int = 5,
+        discord_route_window: float = 5,
+        openai_rpm: int = 0,
+        openai_tpm: int = 0,
+    ):
+        self._local = MemoryBackend()
+        self._backend = backend or self._local
+        self._backend_down = False
+        self._backend_retry_at = 0.0
+        self._discord_global = discord_global
+        self._discord_route = discord_route
+        self._discord_route_window = discord_route_window
+        self._openai_rpm = openai_rpm
+        self._openai_tpm = openai_tpm
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+        self._queued = 0
+
+    def use_backend(self, backend: StateBackend):
+        self._backend = backend
+
+    def queued(self) -> int:
+        return self._queued
+
+    async def _incr(self, key: str, amount: int, ttl: float | None = None) -> int:
+        # While the backend is down, it's retried every few seconds rather than on every call
+        if self._backend is not self._local and time.monotonic() >= self._backend_retry_at:
+            try:
+                value = await asyncio.wait_for(self._backend.incr(key, amount, ttl=ttl), timeout=1)
+            except Exception as e:
+                METRICS.increment("state_backend_errors")
+                self._backend_retry_at = time.monotonic() + 5
+                if not self._backend_down:
+                    self._backend_down = True
+                    print(f"State backend unavailable, rate limiting locally: {e!r}")
+            else:
+                if self._backend_down:
+                    self._backend_down = False
+                    print("State backend is back, sharing rate limits again")
+                return value
+        return await self._local.incr(key, amount, ttl=ttl)
+
+    async def acquire(self, bucket: str, limit: int, window: float, cost: int = 1):
+        """Waits until `cost` units fit in the current `window`-second window of `bucket`. A limit of 0 disables it."""
+        if limit <= 0:
+            return
+        waited = False
+        try:
+            while True:
+                now = time.time()
+                window_id = int(now // window)
+                key = f"rate:{bucket}:{window_id}"
+                count = await self._incr(key, cost, ttl=window * 2)
+                # A single request larger than the limit goes through on an empty window
+                if count <= limit or count == cost:
+                    return
+                await self._incr(key, -cost)
+                if not waited:
+                    waited = True
+                    self._queued += 1
+                    METRICS.increment("rate_limit_waits", bucket=bucket.split(":")[0])
+                await asyncio.sleep((window_id + 1) * window - now)
+        finally:
+            if waited:
+                self._queued -= 1
+
+    async def discord(self, route: str, channel_id: int | None = None):
+        await self.acquire("discord", self._discord_global, 1)
+        if channel_id is not None:
+            await self.acquire(f"discord-{route}:{channel_id}", self._discord_route, self._discord_route_window)
+
+    async def openai(self, tokens: int):
+        await self.acquire("openai-requests", self._openai_rpm, 60)
+        await self.acquire("openai-tokens", self._openai_tpm, 60, cost=tokens)
+
+    async def coalesce(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        """Runs `fetch`, unless a fetch with the same key is in flight, in which case its result is shared."""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fetch())
+            self._inflight[key] = future
+
+            def done(_):
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+            future.add_done_callback(done)
+        else:
+            METRICS.increment("coalesced_fetches")
+        # A waiter being cancelled must not cancel the fetch for the others
+        return await asyncio.shield(future)
+
+
+GOVERNOR = RateGovernor(
+    discord_global=CONFIG.DISCORD_GLOBAL_RATE,
+    discord_route=CONFIG.DISCORD_ROUTE_RATE,
+    discord_route_window=CONFIG.DISCORD_ROUTE_WINDOW,
+    openai_rpm=CONFIG.OPENAI_RPM,
+    openai_tpm=CONFIG.OPENAI_TPM,
+)
@@ -0,0 +1,130 @@
+import asyncio
+import json
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+import discord
+
+from governor import GOVERNOR
+
+
+def format_message(message: discord.Message) -> str:
+    return json.dumps({
+        "user": message.author.name,
+        "created_at": message.created_at.isoformat(),
+        "message": message.clean_content,
+    })
+
+
+@dataclass
+class HistoryEntry:
+    id: int
+    author_id: int
+    created_at: datetime
+    content: str
+    # Pre-serialized `format_message` output
+    formatted: str
+    # Token count of `formatted`, filled in lazily by the context builder
+    tokens: int | None = None
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "HistoryEntry":
+        return cls(
+            id=message.id,
+            author_id=message.author.id,
+            created_at=message.created_at,
+            content=message.clean_content,
+            formatted=format_message(message),
+        )
+
+
+class ChannelHistory:
+    """Ring buffer of the most recent messages of a channel, ordered oldest to newest."""
+
+    def __init__(self, max_messages: int):
+        self._max_messages = max_messages
+        self._entries: OrderedDict[int, HistoryEntry] = OrderedDict()
+        self.warm = False
+        self.lock = asyncio.Lock()
+
+    def add(self, message: discord.Message):
+        entry = HistoryEntry.from_message(message)
+        out_of_order = bool(self._entries) and entry.id < next(reversed(self._entries))
+        self._entries[entry.id] = entry
+        if out_of_order:
+            # Snowflakes are time-ordered, so sorting by id sorts by creation time
+            self._entries = OrderedDict(sorted(self._entries.items()))
+        while len(self._entries) > self._max_messages:
+            self._entries.popitem(last=False)
+
+    def edit(self, message: discord.Message):
+        if message.id in self._entries:
+            self._entries[message.id] = HistoryEntry.from_message(message)
+
+    def delete(self, message_id: int):
+        self._entries.pop(message_id, None)
+
+    def get(self, message_id: int) -> HistoryEntry | None:
+        return self._entries.get(message_id)
+
+    def entries(self) -> list[HistoryEntry]:
+        return list(self._entries.values())
+
+
+class HistoryStore:
+    """
+    In-memory message history for the channels the bot is active in.
+
+    Channels are backfilled from the Discord API the first time they're needed and kept up to
+    date from gateway events afterwards. The least recently used channels are evicted once
+    more than `max_channels` are tracked.
+    """
+
+    def __init__(self, max_messages: int = 100, max_channels: int = 256):
+        self._max_messages = max_messages
+        self._max_channels = max_channels
+        self._channels: OrderedDict[int, ChannelHistory] = OrderedDict()
+
+    def on_message(self, message: discord.Message):
+        # Only track known channels, unknown ones will be backfilled on demand
+        channel = self._channels.get(message.channel.id)
+        if channel is not None:
+            channel.add(message)
+
+    def on_message_edit(self, message: discord.Message):
+        channel = self._channels.get(message.channel.id)
+        if channel is not None:
+            channel.edit(message)
+
+    def on_message_delete(self, message: discord.Message):
+        channel = self._channels.get(message.channel.id)
+        if channel is not None:
+            channel.delete(message.id)
+
+    def lookup(self, channel_id: int, message_id: int) -> HistoryEntry | None:
+        channel = self._channels.get(channel_id)
+        if channel is None:
+            return None
+        return channel.get(message_id)
+
+    async def get(self, channel: discord.abc.Messageable) -> list[HistoryEntry]:
+        history = self._channels.get(channel.id)
+        if history is None:
+            history = ChannelHistory(self._max_messages)
+            self._channels[channel.id] = history
+            while len(self._channels) > self._max_channels:
+                self._channels.popitem(last=False)
+        self._channels.move_to_end(channel.id)
+
+        if not history.warm:
+            async with history.lock:
+                if not history.warm:
+                    # Concurrent requests for the same channel wait on the lock: a single scan is made
+                    await GOVERNOR.discord("history", channel.id)
+                    messages = [message async for message in channel.history(limit=self._max_messages)]
+                    for message in reversed(messages):
+                        history.add(message)
+                    history.warm = True
+
+        return history.entries()
@@ -0,0 +1,203 @@
+import asyncio
+import json
+import os
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
+
+from agents import FunctionTool, function_tool
+
+from similarity import LSHIndex, MinHasher, normalize, shingles
+
+# Characters of the body taken into account, so that the title still weighs in
+BODY_CHARS = 500
+
+
+@dataclass
+class Issue:
+    number: int
+    title: str
+    body: str
+    url: str
+    state: str
+    updated_at: str
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> "Issue":
+        return cls(
+            number=data["number"],
+            title=data.get("title") or "",
+            body=(data.get("body") or "")[:BODY_CHARS],
+            url=data.get("html_url") or data.get("url") or "",
+            state=(data.get("state") or "").lower(),
+            updated_at=data.get("updated_at") or data.get("updatedAt") or "",
+        )
+
+
+class IssueIndex:
+    """
+    Local index of the repository's open and recently updated issues, for duplicate checks.
+
+    Issues are indexed by MinHash signature of their title and the start of their body, and
+    near-duplicates are looked up through LSH. The index is refreshed incrementally in the
+    background (only issues updated since the last refresh are fetched) and snapshotted to
+    disk so restarts don't start over.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        fetch: Callable[[str | None, int, str], Awaitable[list[dict[str, Any]]]],
+        refresh_interval: float = 600,
+        max_age_days: int = 180,
+    ):
+        self._path = path
+        self._fetch = fetch
+        self._refresh_interval = refresh_interval
+        self._max_age = timedelta(days=max_age_days)
+        self._hasher = MinHasher()
+        # Narrow bands: issues about the same thing are often worded quite differently
+        self._index = LSHIndex(num_perm=self._hasher.num_perm, bands=32)
+        self.issues: dict[int, Issue] = {}
+        self._since: str | None = None
+        self._task: asyncio.Task | None = None
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self.issues)
+
+    def _signature(self, title: str, body: str) -> tuple[int, ...]:
+        return self._hasher.signature(shingles(normalize(f"{title} {body[:BODY_CHARS]}")))
+
+    def add(self, issue: Issue, signature: tuple[int, ...] | None = None):
+        self.issues[issue.number] = issue
+        self._index.add(issue.number, signature or self._signature(issue.title, issue.body))
+        if issue.updated_at and (self._since is None or issue.updated_at > self._since):
+            self._since = issue.updated_at
+
+    def similar(self, title: str, body: str = "", limit: int = 5, threshold: float = 0.2) -> list[tuple[Issue, float]]:
+        matches = self._index.query(self._signature(title, body), threshold=threshold, limit=limit)
+        return [(self.issues[number], score) for number, score in matches]
+
+    def _load(self):
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Signatures are saved too: recomputing them takes seconds for a few thousand issues
+        signatures = data.get("signatures") if data.get("num_perm") == self._hasher.num_perm else None
+        for i, issue in enumerate(data["issues"]):
+            self.add(Issue(**issue), tuple(signatures[i]) if signatures else None)
+        self._since = data.get("since", self._since)
+
+    def _save(self):
+        # Each shard worker process refreshes its own index into the same file
+        temporary = f"{self._path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({
+                "since": self._since,
+                "num_perm": self._hasher.num_perm,
+                "issues": [asdict(issue) for issue in self.issues.values()],
+                "signatures": [self._index.signature(number) for number in self.issues],
+            }, f)
+        os.replace(temporary, self._path)
+
+    def _expired(self, issue: Issue) -> bool:
+        if issue.state == "open" or not issue.updated_at:
+            return False
+        updated_at = datetime.fromisoformat(issue.updated_at.replace("Z", "+00:00"))
+        return datetime.now(timezone.utc) - updated_at > self._max_age
+
+    async def _fetch_pages(self, since: str | None, state: str, max_pages: int) -> int:
+        fetched = 0
+        for page in range(1, max_pages + 1):
+            issues = await self._fetch(since, page, state)
+            if not issues:
+                break
+            for data in issues:
+                # The issues API lists pull requests too
+                if "pull_request" in data:
+                    continue
+                self.add(Issue.from_json(data))
+                fetched += 1
+        return fetched
+
+    async def refresh(self, max_pages: int = 50):
+        since = self._since
+        fetched = 0
+        if since is None:
+            since = (datetime.now(timezone.utc) - self._max_age).strftime("%Y-%m-%dT%H:%M:%SZ")
+            # First refresh: all open issues, however long they've been quiet (they're the
+            # likeliest duplicates), then the recently closed ones
+            fetched += await self._fetch_pages(None, "open", max_pages)
+        fetched += await self._fetch_pages(since, "all", max_pages)
+
+        for issue in [issue for issue in self.issues.values() if self._expired(issue)]:
+            del self.issues[issue.number]
+            self._index.remove(issue.number)
+        await asyncio.to_thread(self._save)
+        print(f"Issue index refreshed: {fetched} updated, {len(self.issues)} indexed")
+
+    async def _run(self):
+        while True:
+            interval = self._refresh_interval
+            try:
+                await self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh the issue index: {e}")
+                interval = min(interval, 60)
+            await asyncio.sleep(interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="issue-index")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+def mcp_issue_fetcher(call_tool: Callable[[str, dict[str, Any]], Awaitable[Any]], repo: str) -> Callable[[str | None, int, str], Awaitable[list[dict[str, Any]]]]:
+    """Lists the issues of `repo` in a state, updated since a date, with the GitHub MCP server's list_issues tool."""
+    owner, name = repo.split("/", 1)
+
+    async def fetch(since: str | None, page: int, state: str = "all") -> list[dict[str, Any]]:
+        arguments = {
+            "owner": owner,
+            "repo": name,
+            "state": state,
+            "sort": "updated",
+            "direction": "asc",
+            "page": page,
+            "perPage": 100,
+        }
+        if since is not None:
+            arguments["since"] = since
+        result = await call_tool("list_issues", arguments)
+        text = "".join(getattr(content, "text", "") for content in result.content)
+        if result.isError:
+            raise RuntimeError(text)
+        return json.loads(text)
+
+    return fetch
+
+
+def similar_issues_tool(index: IssueIndex) -> FunctionTool:
+    @function_tool
+    def find_similar_issues(title: str, description: str = "", limit: int = 5) -> str:
+        """Finds existing issues similar to the one about to be filed, from a local index of open and recent issues. Instant.
+
+        Args:
+            title: Title of the issue to file
+            description: Its description
+            limit: Maximum number of issues to return
+        """
+        return json.dumps([
+            {"number": issue.number, "title": issue.title, "url": issue.url, "state": issue.state, "similarity": round(score, 2)}
+            for issue, score in index.similar(title, description, limit=limit)
+        ])
+
+    return find_similar_issues
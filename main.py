@@ -1,22 +1,79 @@
 #!/usr/bin/env -S uv --quiet run --script
 
-from bot import Bot
-from dev import MockBot
+# Imported first to time the rest of startup
+from startup import STARTUP
 import asyncio
-import discord
-from config import CONFIG
 import argparse
 import logging
 
+with STARTUP.phase("config"):
+    from config import CONFIG
+
+# Each mode imports what it needs: the Discord, agents and OpenAI SDKs take over a second
+# to import, and the shard supervisor process doesn't need them at all
+
 async def main():
     parser = argparse.ArgumentParser(description='Discord help agent')
     parser.add_argument('--allow-dms', action='store_true', help='Allow responding to DMs')
     parser.add_argument('--dev', action='store_true', help='Run in dev mode (no discord connection)')
+    parser.add_argument('--shards', type=int, help='Total number of Discord shards, enables sharded mode')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes the shards are spread over in sharded mode, across all nodes')
+    parser.add_argument('--node-index', type=int, default=0, help='Index of this node when the worker processes are spread over several nodes')
+    parser.add_argument('--node-count', type=int, default=1, help='Number of nodes the worker processes are spread over in sharded mode')
+    parser.add_argument('--build-index', action='store_true', help='Build the local search index from --docs and --issues, then exit')
+    parser.add_argument('--docs', help='Directory of a Dagger docs snapshot (Markdown) to index')
+    parser.add_argument('--issues', help='Issues exported with `gh issue list --json number,title,body,url,state` to index')
+    parser.add_argument('--embedding-model', help='Also index embeddings computed with this OpenAI model, e.g. text-embedding-3-small')
+    parser.add_argument('--digest', type=int, metavar='CHANNEL_ID', help='Summarize the conversations of a channel into --output, then exit')
+    parser.add_argument('--hours', type=float, default=24, help='How far back to look in digest mode, in hours')
+    parser.add_argument('--output', default='digest.jsonl', help='Digest results (JSON lines), also used to resume an interrupted run')
+    parser.add_argument('--concurrency', type=int, default=8, help='Conversations summarized concurrently in digest mode')
+    parser.add_argument('--benchmark', nargs='+', metavar='JSONL', help='Replay recorded conversations against stub models and MCP servers')
+    parser.add_argument('--requests', type=int, default=100, help='Number of requests to replay in benchmark mode')
+    parser.add_argument('--rate', type=float, default=10, help='Target request rate (per second) in benchmark mode')
+    parser.add_argument('--model-latency', type=float, default=0.5, help='Latency of stub model calls, in seconds')
+    parser.add_argument('--mcp-latency', type=float, default=0.1, help='Latency of stub MCP tool calls, in seconds')
     args = parser.parse_args()
 
-    intents = discord.Intents.default()
-    intents.message_content = True
-    discord.utils.setup_logging()
+    if args.build_index:
+        import itertools
+        from search import build_index, load_docs, load_issues
+        documents = itertools.chain(
+            load_docs(args.docs) if args.docs else [],
+            load_issues(args.issues) if args.issues else [],
+        )
+        build_index(documents, CONFIG.SEARCH_INDEX_DIR, embedding_model=args.embedding_model)
+        return
+
+    if args.digest:
+        import discord
+        from digest import digest
+        discord.utils.setup_logging()
+        await digest(args.digest, hours=args.hours, output=args.output, concurrency=args.concurrency)
+        return
+
+    if args.benchmark:
+        from benchmark import benchmark
+        await benchmark(
+            args.benchmark,
+            requests=args.requests,
+            rate=args.rate,
+            model_latency=args.model_latency,
+            mcp_latency=args.mcp_latency,
+        )
+        return
+
+    if args.shards:
+        from shard import ShardSupervisor
+        supervisor = ShardSupervisor(
+            shard_count=args.shards,
+            processes=args.processes,
+            allow_dms=args.allow_dms,
+            node_index=args.node_index,
+            node_count=args.node_count,
+        )
+        await supervisor.run()
+        return
 
     if args.dev:
         # In dev mode, remove some noise so we can see the actual output
@@ -24,10 +81,18 @@ async def main():
         logging.getLogger('openai').setLevel(logging.WARNING)
         logging.getLogger('httpx').setLevel(logging.WARNING)
         logging.getLogger('httpcore').setLevel(logging.WARNING)
+        with STARTUP.phase("imports"):
+            from dev import MockBot
         client = await MockBot.create()
         await client.start()
         return
 
+    with STARTUP.phase("imports"):
+        import discord
+        from bot import Bot
+    discord.utils.setup_logging()
+    intents = discord.Intents.default()
+    intents.message_content = True
     client = await Bot.create(intents=intents, allow_dms=args.allow_dms)
     await client.start(CONFIG.DISCORD_TOKEN, reconnect=True)
 
@@ -0,0 +1,186 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable
+
+from agents import add_trace_processor, custom_span
+from agents.tracing import Span, Trace, TracingProcessor
+from aiohttp import web
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels.items())) + "}"
+
+
+def _duration(span: Span[Any]) -> float | None:
+    if span.started_at is None or span.ended_at is None:
+        return None
+    return (datetime.fromisoformat(span.ended_at) - datetime.fromisoformat(span.started_at)).total_seconds()
+
+
+class Metrics(TracingProcessor):
+    """
+    Turns agent SDK spans (model calls, tool calls, sub-agents, MCP calls) and our own stage spans
+    into Prometheus metrics, served over HTTP, and optionally into a JSONL span log.
+    """
+
+    def __init__(self, prefix: str = "dagger_assistant"):
+        self._prefix = prefix
+        self._durations: dict[tuple[str, tuple], Histogram] = {}
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self._span_log = None
+        self._runner: web.AppRunner | None = None
+
+    def install(self, span_log_path: str | None = None):
+        if span_log_path:
+            self._span_log = open(span_log_path, "a", buffering=1)
+        add_trace_processor(self)
+
+    def observe(self, stage: str, duration: float, **labels: str):
+        key = (stage, tuple(sorted(labels.items())))
+        histogram = self._durations.get(key)
+        if histogram is None:
+            histogram = self._durations[key] = Histogram()
+        histogram.observe(duration)
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+
+    def stages(self) -> dict[tuple[str, tuple], Histogram]:
+        return dict(self._durations)
+
+    def register_gauge(self, name: str, value: Callable[[], float]):
+        self._gauges[name] = value
+
+    def render(self) -> str:
+        lines = [f"# TYPE {self._prefix}_stage_duration_seconds histogram"]
+        for (stage, labels), histogram in sorted(self._durations.items()):
+            labels = {"stage": stage, **dict(labels)}
+            for bound, count in zip(BUCKETS, histogram.counts):
+                lines.append(f"{self._prefix}_stage_duration_seconds_bucket{_labels({**labels, 'le': str(bound)})} {count}")
+            lines.append(f"{self._prefix}_stage_duration_seconds_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+            lines.append(f"{self._prefix}_stage_duration_seconds_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{self._prefix}_stage_duration_seconds_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{self._prefix}_{name}_total{_labels(dict(labels))} {value}")
+        for name, value in sorted(self._gauges.items()):
+            lines.append(f"{self._prefix}_{name} {value()}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str, port: int):
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Serving metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # TracingProcessor
+
+    def on_trace_start(self, trace: Trace) -> None:
+        pass
+
+    def on_trace_end(self, trace: Trace) -> None:
+        pass
+
+    def on_span_start(self, span: Span[Any]) -> None:
+        pass
+
+    def on_span_end(self, span: Span[Any]) -> None:
+        duration = _duration(span)
+        if duration is None:
+            return
+
+        data = span.span_data
+        labels: dict[str, str] = {}
+        if data.type == "custom":
+            stage = data.name
+        elif data.type == "response":
+            stage = "model_call"
+            response = data.response
+            if response is not None:
+                labels["model"] = response.model
+                if response.usage is not None:
+                    self.increment("model_tokens", response.usage.input_tokens, model=response.model, kind="input")
+                    self.increment("model_tokens", response.usage.output_tokens, model=response.model, kind="output")
+        elif data.type == "function":
+            # Sub-agents called as tools are function tools too
+            if data.mcp_data is not None:
+                stage = "mcp_tool_call"
+                labels["server"] = data.mcp_data.get("server", "")
+            else:
+                stage = "tool_call"
+            labels["tool"] = data.name
+        elif data.type == "mcp_tools":
+            stage = "mcp_list_tools"
+            labels["server"] = data.server or ""
+        elif data.type == "agent":
+            stage = "agent"
+            labels["agent"] = data.name
+        else:
+            stage = data.type
+
+        self.observe(stage, duration, **labels)
+        if span.error is not None:
+            self.increment("stage_errors", stage=stage)
+
+        if self._span_log is not None:
+            self._span_log.write(json.dumps({
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_id": span.parent_id,
+                "stage": stage,
+                "labels": labels,
+                "started_at": span.started_at,
+                "duration": duration,
+                "error": span.error,
+            }) + "\n")
+
+    def shutdown(self) -> None:
+        if self._span_log is not None:
+            self._span_log.close()
+            self._span_log = None
+
+    def force_flush(self) -> None:
+        if self._span_log is not None:
+            self._span_log.flush()
+
+
+METRICS = Metrics()
+
+
+@contextmanager
+def stage(name: str, **data: Any):
+    """Records a stage of the request being processed as a span of the current trace."""
+    with custom_span(name, data=data):
+        yield
+
@@ -0,0 +1,220 @@
+import json
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+
+from agents import Model, ModelProvider, ModelResponse, ModelSettings, ModelTracing, OpenAIProvider, Tool
+from agents.agent_output import AgentOutputSchemaBase
+from agents.exceptions import ModelBehaviorError
+from agents.items import ItemHelpers, TResponseStreamEvent
+from openai.types.responses import ResponseOutputMessage
+
+from config import CONFIG
+from context import count_tokens
+from governor import GOVERNOR
+from metrics import METRICS
+
+
+@dataclass
+class Decision:
+    agent: str
+    model: str
+    reason: str
+    input_tokens: int
+
+
+class ModelSelector:
+    """
+    Picks the model each agent call runs on.
+
+    Agents with the "large" policy always use the large model. Agents with the "auto" policy
+    use the small model, unless the input is larger than `small_max_tokens`, or the small
+    model's recent p95 latency is above `latency_target` while the large model is faster.
+    Small model outputs that fail validation are retried on the large model.
+
+    Latencies are measured over the last `latency_window` seconds, and a share of "auto"
+    calls (`explore_rate`) goes to the model that wasn't picked, so that a model left
+    aside for being slow gets measured again and picked back once it recovers.
+
+    Decisions are counted in the metrics, and appended to `decision_log_path` when set.
+    """
+
+    def __init__(
+        self,
+        large: str,
+        small: str,
+        policies: dict[str, str],
+        small_max_tokens: int = 4000,
+        latency_target: float = 10,
+        latency_window: float = 600,
+        explore_rate: float = 0.05,
+        decision_log_path: str | None = None,
+        provider: ModelProvider | None = None,
+    ):
+        self.large = large
+        self.small = small
+        self._policies = policies
+        self._small_max_tokens = small_max_tokens
+        self._latency_target = latency_target
+        self._latency_window = latency_window
+        self._explore_rate = explore_rate
+        self._decision_log = open(decision_log_path, "a", buffering=1) if decision_log_path else None
+        # Swappable, e.g. for stand-ins when benchmarking
+        self.provider: ModelProvider = provider or OpenAIProvider()
+        # (time, duration) of recent calls, by model
+        self._latencies: dict[str, deque[tuple[float, float]]] = {}
+
+    @classmethod
+    def from_config(cls, provider: ModelProvider | None = None) -> "ModelSelector":
+        return cls(
+            large=CONFIG.MODEL_LARGE,
+            small=CONFIG.MODEL_SMALL,
+            policies=CONFIG.MODEL_POLICIES,
+            small_max_tokens=CONFIG.MODEL_SMALL_MAX_TOKENS,
+            latency_target=CONFIG.MODEL_LATENCY_TARGET,
+            latency_window=CONFIG.MODEL_LATENCY_WINDOW,
+            explore_rate=CONFIG.MODEL_EXPLORE_RATE,
+            decision_log_path=CONFIG.MODEL_DECISION_LOG_PATH,
+            provider=provider,
+        )
+
+    def policy(self, agent: str) -> str:
+        return self._policies.get(agent, "large")
+
+    def latency(self, model: str, p: float = 0.95) -> float | None:
+        latencies = self._latencies.get(model)
+        if not latencies:
+            return None
+        since = time.monotonic() - self._latency_window
+        while latencies and latencies[0][0] < since:
+            latencies.popleft()
+        if not latencies:
+            return None
+        ordered = sorted(duration for _, duration in latencies)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    def observe(self, model: str, duration: float):
+        self._latencies.setdefault(model, deque(maxlen=200)).append((time.monotonic(), duration))
+
+    def select(self, agent: str, input_tokens: int) -> Decision:
+        if self.policy(agent) != "auto":
+            return Decision(agent, self.large, "policy", input_tokens)
+        if input_tokens > self._small_max_tokens:
+            return Decision(agent, self.large, "input_size", input_tokens)
+        small_latency = self.latency(self.small)
+        large_latency = self.latency(self.large)
+        model, reason = self.small, "auto"
+        if (
+            small_latency is not None and small_latency > self._latency_target
+            and large_latency is not None and large_latency < small_latency
+        ):
+            model, reason = self.large, "latency"
+        if random.random() < self._explore_rate:
+            model, reason = (self.large if model == self.small else self.small), "explore"
+        return Decision(agent, model, reason, input_tokens)
+
+    def record(self, decision: Decision):
+        METRICS.increment("model_decisions", agent=decision.agent, model=decision.model, reason=decision.reason)
+        if self._decision_log is not None:
+            self._decision_log.write(json.dumps({
+                "time": time.time(),
+                "agent": decision.agent,
+                "model": decision.model,
+                "reason": decision.reason,
+                "input_tokens": decision.input_tokens,
+            }) + "\n")
+
+    def model(self, agent: str) -> "TieredModel":
+        return TieredModel(agent, self)
+
+
+def _input_tokens(system_instructions: str | None, input: str | list) -> int:
+    text = input if isinstance(input, str) else json.dumps(input, default=str)
+    return count_tokens((system_instructions or "") + text)
+
+
+def _validate(response: ModelResponse, output_schema: AgentOutputSchemaBase | None) -> bool:
+    # Only final answers are validated: tool calls are checked by the tools themselves
+    if output_schema is None or output_schema.is_plain_text():
+        return True
+    messages = [item for item in response.output if isinstance(item, ResponseOutputMessage)]
+    if not messages or len(messages) != len(response.output):
+        return True
+    try:
+        output_schema.validate_json(ItemHelpers.extract_last_text(messages[-1]) or "")
+    except ModelBehaviorError:
+        return False
+    return True
+
+
+class TieredModel(Model):
+    """Model used by an agent, running each call on the model picked by the selector."""
+
+    def __init__(self, agent: str, selector: ModelSelector):
+        self._agent = agent
+        self._selector = selector
+
+    async def _call(self, model: str, input_tokens: int, *args, **kwargs) -> ModelResponse:
+        await GOVERNOR.openai(input_tokens)
+        start = time.monotonic()
+        response = await self._selector.provider.get_model(model).get_response(*args, **kwargs)
+        self._selector.observe(model, time.monotonic() - start)
+        return response
+
+    async def get_response(
+        self,
+        system_instructions: str | None,
+        input: str | list,
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: AgentOutputSchemaBase | None,
+        handoffs: list,
+        tracing: ModelTracing,
+        *,
+        previous_response_id: str | None,
+    ) -> ModelResponse:
+        args = (system_instructions, input, model_settings, tools, output_schema, handoffs, tracing)
+        decision = self._selector.select(self._agent, _input_tokens(system_instructions, input))
+        self._selector.record(decision)
+        response = await self._call(decision.model, decision.input_tokens, *args, previous_response_id=previous_response_id)
+
+        if decision.model != self._selector.large and not _validate(response, output_schema):
+            escalation = Decision(self._agent, self._selector.large, "validation_failed", decision.input_tokens)
+            self._selector.record(escalation)
+            response = await self._call(escalation.model, escalation.input_tokens, *args, previous_response_id=previous_response_id)
+        return response
+
+    async def stream_response(
+        self,
+        system_instructions: str | None,
+        input: str | list,
+        model_settings: ModelSettings,
+        tools: list[Tool],
+        output_schema: AgentOutputSchemaBase | None,
+        handoffs: list,
+        tracing: ModelTracing,
+        *,
+        previous_response_id: str | None,
+    ) -> AsyncIterator[TResponseStreamEvent]:
+        # Streamed output can't be taken back: structured outputs go straight to the large model
+        decision = self._selector.select(self._agent, _input_tokens(system_instructions, input))
+        if output_schema is not None and not output_schema.is_plain_text() and decision.model != self._selector.large:
+            decision = Decision(self._agent, self._selector.large, "streamed_output", decision.input_tokens)
+        self._selector.record(decision)
+
+        await GOVERNOR.openai(decision.input_tokens)
+        start = time.monotonic()
+        async for event in self._selector.provider.get_model(decision.model).stream_response(
+            system_instructions,
+            input,
+            model_settings,
+            tools,
+            output_schema,
+            handoffs,
+            tracing,
+            previous_response_id=previous_response_id,
+        ):
+            yield event
+        self._selector.observe(decision.model, time.monotonic() - start)
@@ -0,0 +1,97 @@
+import hashlib
+import re
+
+from cache import TTLCache
+from similarity import LSHIndex, MinHasher, normalize, shingles
+from state import StateBackend
+
+# Parts of a mention that must match exactly: code, URLs, and anything with a digit in it
+# (issue and PR numbers, versions, trace IDs), which shingles barely tell apart
+_SPECIFICS = re.compile(r"```.*?```|`[^`]+`|https?://\S+|[\w.#/-]*\d[\w.#/-]*", re.DOTALL)
+
+
+def specifics(text: str) -> str:
+    return "\n".join(sorted(set(_SPECIFICS.findall(text))))
+
+
+class ResponseCache:
+    """
+    Caches responses to mentions. A mention is answered from the cache when its normalized
+    text was seen before, or when it is at least `threshold` similar to a cached mention
+    (MinHash estimate of the Jaccard similarity of their character shingles) and mentions
+    the same code, URLs, numbers and versions. Both must also share the same `context`,
+    e.g. the conversation the question was asked in.
+    Entries expire after `ttl` seconds, and the least recently used are evicted past `max_size`.
+
+    With a shared `backend`, responses are also written there, so that exact repeats are
+    answered from the cache by every process. Near-duplicates are matched locally.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        max_size: int = 512,
+        ttl: float = 3600,
+        min_length: int = 16,
+        backend: StateBackend | None = None,
+    ):
+        self._threshold = threshold
+        self._ttl = ttl
+        self._min_length = min_length
+        self._backend = backend
+        self._hasher = MinHasher()
+        self._index = LSHIndex(num_perm=self._hasher.num_perm)
+        self._responses: TTLCache[str] = TTLCache(max_size=max_size, ttl=ttl, on_evict=self._index.remove)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def cacheable(self, text: str) -> bool:
+        # Very short mentions ("thanks!", "any update?") depend on context we don't key on
+        return len(normalize(text)) >= self._min_length
+
+    def _key(self, text: str, context: str) -> tuple[str, str, str]:
+        return normalize(text), specifics(text), context
+
+    def _backend_key(self, key: tuple[str, str, str]) -> str:
+        return "response:" + hashlib.sha256("\0".join(key).encode()).hexdigest()
+
+    async def get(self, text: str, context: str = "") -> str | None:
+        key = self._key(text, context)
+        response = self._responses.get(key)
+        if response is None:
+            signature = self._hasher.signature(shingles(key[0]))
+            for candidate, _ in self._index.query(signature, threshold=self._threshold):
+                if candidate[1:] != key[1:]:
+                    continue
+                response = self._responses.get(candidate)
+                if response is not None:
+                    break
+        if response is None and self._backend is not None:
+            try:
+                response = await self._backend.get(self._backend_key(key))
+            except Exception as e:
+                # Answering without the cache beats not answering
+                print(f"Failed to read the shared response cache: {e!r}")
+
+        if response is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return response
+
+    async def put(self, text: str, response: str, context: str = ""):
+        key = self._key(text, context)
+        self._index.add(key, self._hasher.signature(shingles(key[0])))
+        self._responses.set(key, response)
+        if self._backend is not None:
+            try:
+                await self._backend.set(self._backend_key(key), response, ttl=self._ttl)
+            except Exception as e:
+                print(f"Failed to write to the shared response cache: {e!r}")
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
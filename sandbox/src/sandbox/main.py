@@ -1,43 +1,297 @@
+import asyncio
+import hashlib
+import shlex
+import time
+from dataclasses import dataclass
+
+import dagger
 from dagger import dag, function, object_type
 
+
+@dataclass
+class Language:
+    image: str
+    filename: str
+    # Shell command preparing the execution (dependencies, compilation), not subject to limits
+    prepare: str | None
+    # Shell command installing dependencies, given as arguments
+    install: str | None
+    # Shell command running the program
+    run: str
+    # Cache volumes, by mount path
+    caches: dict[str, str]
+
+
+LANGUAGES = {
+    "go": Language(
+        image="golang:1.23-alpine",
+        filename="main.go",
+        # go mod tidy resolves the dependencies from the imports
+        prepare="go mod init sandbox >/dev/null 2>&1; go mod tidy && go build -o /tmp/main .",
+        install=None,
+        run="/tmp/main",
+        caches={
+            "/go/pkg/mod": "sandbox-go-mod",
+            "/root/.cache/go-build": "sandbox-go-build",
+        },
+    ),
+    "python": Language(
+        image="python:3.13-alpine",
+        filename="main.py",
+        prepare=None,
+        install="pip install --quiet",
+        run="python main.py",
+        caches={
+            "/root/.cache/pip": "sandbox-pip",
+        },
+    ),
+    "javascript": Language(
+        image="node:22-alpine",
+        filename="main.js",
+        prepare=None,
+        install="npm install --silent --no-fund --no-audit",
+        run="node main.js",
+        caches={
+            "/root/.npm": "sandbox-npm",
+        },
+    ),
+}
+
+LANGUAGE_ALIASES = {
+    "golang": "go",
+    "js": "javascript",
+}
+
+SHELL_IMAGE = "alpine"
+
+# Identical executions are served from the engine cache for this long
+MEMO_TTL = 600
+
+# Extra time given to the engine (image pulls, compilation) on top of the execution timeout
+GRACE_PERIOD = 120
+
+# Runs $SANDBOX_PREPARE in an exec of its own, with the cache volumes mounted, recording its
+# exit code for the RUNNER exec
+PREPARER = """
+: > /tmp/stdout
+: > /tmp/stderr
+timeout -s KILL "$SANDBOX_TIMEOUT" sh -c "$SANDBOX_PREPARE" >> /tmp/stdout 2>> /tmp/stderr
+echo $? > /tmp/prepare-status
+"""
+
+# Runs $SANDBOX_RUN under the limits, unless the preparation failed. Output goes to files whose
+# size is capped by `ulimit -f`: a program writing past the cap is killed right away.
+RUNNER = """
+if [ -f /tmp/prepare-status ]; then
+    status=$(cat /tmp/prepare-status)
+    if [ "$status" != 0 ]; then exit "$status"; fi
+else
+    : > /tmp/stdout
+    : > /tmp/stderr
+fi
+(
+    ulimit -f "$SANDBOX_OUTPUT_BLOCKS"
+    ulimit -t "$SANDBOX_CPU"
+    if [ "$SANDBOX_MEMORY_KB" -gt 0 ]; then ulimit -v "$SANDBOX_MEMORY_KB"; fi
+    exec timeout -s KILL "$SANDBOX_TIMEOUT" sh -c "$SANDBOX_RUN"
+) >> /tmp/stdout 2>> /tmp/stderr
+"""
+
+
+@dataclass
+class Limits:
+    # Wall-clock seconds
+    timeout: int
+    # CPU seconds
+    cpu: int
+    # Megabytes of address space, 0 for no limit
+    memory: int
+    # Bytes of stdout and stderr, each
+    output: int
+
+
+def _language(language: str) -> str:
+    language = LANGUAGE_ALIASES.get(language, language)
+    if language not in LANGUAGES:
+        raise ValueError(f"Unsupported language: {language}")
+    return language
+
+
+def _memo_key(*parts: str) -> str:
+    # The engine caches execs by content: keeping this stable for MEMO_TTL seconds makes
+    # re-runs of the same code instant, and changing it afterwards forces a fresh run.
+    epoch = int(time.time() // MEMO_TTL)
+    digest = hashlib.sha256("\0".join(parts).encode()).hexdigest()
+    return f"{digest}-{epoch}"
+
+
+async def _pull(image: str) -> str:
+    container = await dag.container().from_(image).sync()
+    return await container.image_ref()
+
+
+def _limited_exec(
+    container: dagger.Container,
+    prepare: str | None,
+    run: str,
+    limits: Limits,
+    memo_key: str,
+    caches: dict[str, str] | None = None,
+) -> dagger.Container:
+    container = (
+        container
+        .with_env_variable("SANDBOX_TIMEOUT", str(limits.timeout))
+        .with_env_variable("SANDBOX_MEMO_KEY", memo_key)
+    )
+    if prepare:
+        # The cache volumes are shared by all executions: only dependency installation and
+        # compilation get to write to them, never the user's program
+        for path, volume in (caches or {}).items():
+            container = container.with_mounted_cache(path, dag.cache_volume(volume))
+        container = container.with_env_variable("SANDBOX_PREPARE", prepare).with_exec(["sh", "-c", PREPARER])
+        for path in caches or {}:
+            container = container.without_mount(path)
+    return (
+        container
+        .with_env_variable("SANDBOX_RUN", run)
+        .with_env_variable("SANDBOX_CPU", str(limits.cpu))
+        .with_env_variable("SANDBOX_MEMORY_KB", str(limits.memory * 1024))
+        # ulimit -f counts 512-byte blocks, allow one more byte than the limit to detect truncation
+        .with_env_variable("SANDBOX_OUTPUT_BLOCKS", str(limits.output // 512 + 1))
+        .with_exec(["sh", "-c", RUNNER], expect=dagger.ReturnType.ANY)
+    )
+
+
+def _code_container(language: str, code: str, dependencies: list[str], limits: Limits) -> dagger.Container:
+    spec = LANGUAGES[language]
+    prepare = spec.prepare
+    if dependencies and spec.install:
+        install = f"{spec.install} {shlex.join(dependencies)}"
+        prepare = f"{install} && {prepare}" if prepare else install
+
+    container = (
+        dag.container()
+        .from_(spec.image)
+        .with_workdir("/app")
+        .with_new_file(f"/app/{spec.filename}", code)
+    )
+    memo_key = _memo_key(language, code, *dependencies, str(limits))
+    return _limited_exec(container, prepare, spec.run, limits, memo_key, caches=spec.caches)
+
+
+@object_type
+class ExecResult:
+    language: str = dagger.field()
+    stdout: str = dagger.field()
+    stderr: str = dagger.field()
+    exit_code: int = dagger.field()
+    duration: float = dagger.field(doc="Wall-clock duration, in seconds")
+    truncated: bool = dagger.field(doc="Whether stdout or stderr exceeded the output limit")
+
+
+def _truncate(output: str, limit: int) -> tuple[str, bool]:
+    if len(output.encode()) <= limit:
+        return output, False
+    return output.encode()[:limit].decode(errors="ignore"), True
+
+
+async def _exec_result(language: str, container: dagger.Container, limits: Limits) -> ExecResult:
+    start = time.monotonic()
+
+    async def run():
+        executed = await container.sync()
+        return await asyncio.gather(
+            executed.file("/tmp/stdout").contents(),
+            executed.file("/tmp/stderr").contents(),
+            executed.exit_code(),
+        )
+
+    try:
+        stdout, stderr, exit_code = await asyncio.wait_for(run(), timeout=limits.timeout + GRACE_PERIOD)
+    except asyncio.TimeoutError:
+        stdout, stderr, exit_code = "", f"Timed out after {limits.timeout + GRACE_PERIOD}s", -1
+
+    stdout, stdout_truncated = _truncate(stdout, limits.output)
+    stderr, stderr_truncated = _truncate(stderr, limits.output)
+    return ExecResult(
+        language=language,
+        stdout=stdout,
+        stderr=stderr,
+        exit_code=exit_code,
+        duration=time.monotonic() - start,
+        truncated=stdout_truncated or stderr_truncated,
+    )
+
+
 @object_type
 class Sandbox:
     @function
-    async def run_code(self, language: str, code: str) -> str:
-        """Builds and executes code. Returns stdout"""
-        if language == "go" or language == "golang":
-            return await (
-                dag.container()
-                .from_("golang:1.23-alpine")
-                .with_workdir("/app")
-                .with_new_file("/app/main.go", code)
-                .with_exec(["go", "run", "main.go"])
-            ).stdout()
-        elif language == "python":
-            return await (
-                dag.container()
-                .from_("python:3.13-alpine")
-                .with_workdir("/app")
-                .with_new_file("/app/main.py", code)
-                .with_exec(["python", "main.py"])
-            ).stdout()
-        elif language == "js" or language =="javascript":
-            return await (
-                dag.container()
-                .from_("node:22-alpine")
-                .with_workdir("/app")
-                .with_new_file("/app/main.js", code)
-                .with_exec(["node", "main.js"])
-            ).stdout()
-        else:
-            raise ValueError(f"Unsupported language: {language}")
+    async def warm(self) -> str:
+        """Pulls the images of all supported languages ahead of time. Returns the pinned image references"""
+        images = [spec.image for spec in LANGUAGES.values()] + [SHELL_IMAGE]
+        refs = await asyncio.gather(*[_pull(image) for image in images])
+        return "\n".join(f"{image}={ref}" for image, ref in zip(images, refs))
+
+    @function
+    async def run_code(
+        self,
+        language: str,
+        code: str,
+        dependencies: list[str] | None = None,
+        timeout: int = 60,
+        cpu: int = 30,
+        memory: int = 4096,
+        output: int = 65536,
+    ) -> ExecResult:
+        """Builds and executes code, installing the given packages first (Go dependencies are resolved from imports).
+        Execution is limited to `timeout` seconds, `cpu` CPU seconds, `memory` MB (0 for no limit) and `output` bytes of stdout and stderr.
+        Returns stdout, stderr, exit code, duration and whether the output was truncated"""
+        language = _language(language)
+        limits = Limits(timeout=timeout, cpu=cpu, memory=memory, output=output)
+        return await _exec_result(language, _code_container(language, code, dependencies or [], limits), limits)
+
+    @function
+    async def run_batch(
+        self,
+        languages: list[str],
+        codes: list[str],
+        concurrency: int = 4,
+        timeout: int = 60,
+        cpu: int = 30,
+        memory: int = 4096,
+        output: int = 65536,
+    ) -> list[ExecResult]:
+        """Builds and executes many snippets concurrently, codes[i] being written in languages[i].
+        Limits apply to each snippet, as in run-code.
+        Returns the stdout, stderr, exit code, duration and truncation of each"""
+        if len(languages) != len(codes):
+            raise ValueError("languages and codes must have the same length")
+
+        limits = Limits(timeout=timeout, cpu=cpu, memory=memory, output=output)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def run(language: str, code: str) -> ExecResult:
+            try:
+                language = _language(language)
+            except ValueError as e:
+                # Reported with the snippet, the rest of the batch still runs
+                return ExecResult(language=language, stdout="", stderr=str(e), exit_code=-1, duration=0.0, truncated=False)
+            async with semaphore:
+                return await _exec_result(language, _code_container(language, code, [], limits), limits)
+
+        return await asyncio.gather(*[run(language, code) for language, code in zip(languages, codes)])
 
     @function
-    async def run_command(self, command: str) -> str:
-        """Runs a shell command. Returns stdout"""
-        return await (
-            dag.container()
-            .from_("alpine")
-            .with_workdir("/app")
-            .with_exec(["sh", "-c", command])
-        ).stdout()
+    async def run_command(
+        self,
+        command: str,
+        timeout: int = 60,
+        cpu: int = 30,
+        memory: int = 4096,
+        output: int = 65536,
+    ) -> ExecResult:
+        """Runs a shell command, with the same limits as run-code. Returns stdout, stderr, exit code, duration and whether the output was truncated"""
+        limits = Limits(timeout=timeout, cpu=cpu, memory=memory, output=output)
+        container = dag.container().from_(SHELL_IMAGE).with_workdir("/app")
+        memo_key = _memo_key("shell", command, str(limits))
+        return await _exec_result("shell", _limited_exec(container, None, command, limits, memo_key), limits)
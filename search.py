@@ -0,0 +1,287 @@
+import json
+import math
+import mmap
+import os
+import re
+from array import array
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Iterable
+
+from agents import FunctionTool, function_tool
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_TOKEN = re.compile(r"[a-z0-9_]+")
+_STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "how", "i", "in", "is", "it",
+    "of", "on", "or", "that", "the", "this", "to", "was", "what", "when", "with", "you",
+}
+
+# Words per passage when splitting long documents
+PASSAGE_WORDS = 200
+
+
+def tokenize(text: str) -> list[str]:
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+@dataclass
+class Document:
+    source: str
+    title: str
+    text: str
+
+
+def _passages(source: str, title: str, text: str) -> Iterable[Document]:
+    # Split on headings first, then cap passages at PASSAGE_WORDS words
+    for section in re.split(r"\n(?=#{1,4} )", text):
+        heading = section.splitlines()[0].lstrip("# ").strip() if section.startswith("#") else ""
+        words = section.split()
+        for i in range(0, len(words), PASSAGE_WORDS):
+            chunk = " ".join(words[i:i + PASSAGE_WORDS])
+            if chunk.strip():
+                yield Document(source=source, title=f"{title} - {heading}" if heading else title, text=chunk)
+
+
+def load_docs(directory: str, base_url: str = "https://docs.dagger.io/") -> Iterable[Document]:
+    """Passages of the Markdown files of a docs snapshot."""
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if not name.endswith((".md", ".mdx")):
+                continue
+            path = os.path.join(root, name)
+            with open(path, errors="ignore") as f:
+                text = f.read()
+            # Drop front matter
+            text = re.sub(r"\A---\n.*?\n---\n", "", text, flags=re.DOTALL)
+            relative = os.path.splitext(os.path.relpath(path, directory))[0]
+            title = os.path.basename(relative).replace("-", " ")
+            yield from _passages(base_url + relative, title, text)
+
+
+def load_issues(path: str) -> Iterable[Document]:
+    """Issues exported as a JSON array or JSON lines, e.g. with
+    `gh issue list -R <repo> --state all --limit 10000 --json number,title,body,url,state`."""
+    with open(path) as f:
+        data = f.read().strip()
+    issues = json.loads(data) if data.startswith("[") else [json.loads(line) for line in data.splitlines() if line.strip()]
+    for issue in issues:
+        title = f"#{issue['number']} {issue['title']}"
+        if issue.get("state"):
+            title += f" ({issue['state'].lower()})"
+        yield from _passages(issue.get("url", ""), title, f"{issue['title']}\n\n{issue.get('body') or ''}")
+
+
+def _embed(texts: list[str], model: str) -> list[list[float]]:
+    from openai import OpenAI
+    client = OpenAI()
+    vectors = []
+    for i in range(0, len(texts), 256):
+        response = client.embeddings.create(model=model, input=texts[i:i + 256])
+        vectors.extend(item.embedding for item in response.data)
+    return vectors
+
+
+def build_index(documents: Iterable[Document], directory: str, embedding_model: str | None = None):
+    """
+    Writes a BM25 index of the documents to `directory`, with normalized embeddings when an
+    embedding model is given. All files are flat arrays, memory-mapped when searching.
+    """
+    os.makedirs(directory, exist_ok=True)
+    postings: dict[str, list[tuple[int, int]]] = {}
+    lengths = array("I")
+    offsets = array("Q", [0])
+    texts = []
+
+    with open(os.path.join(directory, "docs.jsonl"), "wb") as docs:
+        for doc_id, document in enumerate(documents):
+            tokens = tokenize(f"{document.title} {document.text}")
+            lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                postings.setdefault(term, []).append((doc_id, count))
+            line = json.dumps({"source": document.source, "title": document.title, "text": document.text}).encode() + b"\n"
+            docs.write(line)
+            offsets.append(offsets[-1] + len(line))
+            texts.append(f"{document.title}\n{document.text}")
+
+    terms = {}
+    flat = array("I")
+    for term, entries in postings.items():
+        terms[term] = [len(flat) // 2, len(entries)]
+        for doc_id, count in entries:
+            flat.extend((doc_id, count))
+    with open(os.path.join(directory, "postings.bin"), "wb") as f:
+        flat.tofile(f)
+    with open(os.path.join(directory, "lengths.bin"), "wb") as f:
+        lengths.tofile(f)
+    with open(os.path.join(directory, "offsets.bin"), "wb") as f:
+        offsets.tofile(f)
+    with open(os.path.join(directory, "terms.json"), "w") as f:
+        json.dump(terms, f)
+
+    dimensions = 0
+    if embedding_model and texts:
+        vectors = array("f")
+        for vector in _embed(texts, embedding_model):
+            norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+            vectors.extend(value / norm for value in vector)
+            dimensions = len(vector)
+        with open(os.path.join(directory, "vectors.bin"), "wb") as f:
+            vectors.tofile(f)
+
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump({
+            "documents": len(lengths),
+            "average_length": sum(lengths) / len(lengths) if lengths else 0,
+            "dimensions": dimensions,
+            "embedding_model": embedding_model if dimensions else None,
+        }, f)
+    print(f"Indexed {len(lengths)} passages, {len(terms)} terms into {directory}")
+
+
+def _mmap(path: str) -> mmap.mmap | None:
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@dataclass
+class SearchResult:
+    source: str
+    title: str
+    snippet: str
+    score: float
+
+
+class SearchIndex:
+    """
+    Searches an index written by `build_index`: BM25 over memory-mapped postings, fused with
+    embedding similarity (reciprocal rank fusion) when the index has vectors and numpy is
+    installed. Only the term dictionary is loaded in memory.
+    """
+
+    def __init__(self, directory: str, k1: float = 1.2, b: float = 0.75):
+        with open(os.path.join(directory, "meta.json")) as f:
+            self._meta = json.load(f)
+        with open(os.path.join(directory, "terms.json")) as f:
+            self._terms: dict[str, list[int]] = json.load(f)
+        self._k1 = k1
+        self._b = b
+        self._maps = []
+        self._postings = self._view(os.path.join(directory, "postings.bin"), "I")
+        self._lengths = self._view(os.path.join(directory, "lengths.bin"), "I")
+        self._offsets = self._view(os.path.join(directory, "offsets.bin"), "Q")
+        self._docs = _mmap(os.path.join(directory, "docs.jsonl"))
+        self._vectors = None
+        if self._meta["dimensions"] and numpy is not None:
+            vectors = _mmap(os.path.join(directory, "vectors.bin"))
+            if vectors is not None:
+                self._maps.append(vectors)
+                self._vectors = numpy.frombuffer(vectors, dtype=numpy.float32).reshape(-1, self._meta["dimensions"])
+
+    def _view(self, path: str, format: str) -> memoryview:
+        mapped = _mmap(path)
+        if mapped is None:
+            return memoryview(array(format))
+        self._maps.append(mapped)
+        return memoryview(mapped).cast(format)
+
+    def __len__(self) -> int:
+        return self._meta["documents"]
+
+    @property
+    def embedding_model(self) -> str | None:
+        return self._meta["embedding_model"] if self._vectors is not None else None
+
+    def document(self, doc_id: int) -> dict[str, Any]:
+        return json.loads(self._docs[self._offsets[doc_id]:self._offsets[doc_id + 1]])
+
+    def bm25(self, query: str, limit: int = 50) -> list[tuple[int, float]]:
+        documents = len(self)
+        average_length = self._meta["average_length"] or 1
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            entry = self._terms.get(term)
+            if entry is None:
+                continue
+            start, count = entry
+            idf = math.log(1 + (documents - count + 0.5) / (count + 0.5))
+            for i in range(start, start + count):
+                doc_id, frequency = self._postings[2 * i], self._postings[2 * i + 1]
+                norm = self._k1 * (1 - self._b + self._b * self._lengths[doc_id] / average_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * frequency * (self._k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    def nearest(self, vector: list[float], limit: int = 50) -> list[tuple[int, float]]:
+        if self._vectors is None:
+            return []
+        query = numpy.asarray(vector, dtype=numpy.float32)
+        query /= numpy.linalg.norm(query) or 1.0
+        scores = self._vectors @ query
+        top = numpy.argsort(-scores)[:limit]
+        return [(int(doc_id), float(scores[doc_id])) for doc_id in top]
+
+    def search(self, query: str, limit: int = 5, vector: list[float] | None = None) -> list[SearchResult]:
+        rankings = [self.bm25(query)]
+        if vector is not None:
+            rankings.append(self.nearest(vector))
+        fused: dict[int, float] = {}
+        for ranking in rankings:
+            for rank, (doc_id, _) in enumerate(ranking):
+                fused[doc_id] = fused.get(doc_id, 0.0) + 1 / (60 + rank)
+
+        results = []
+        for doc_id, score in sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]:
+            document = self.document(doc_id)
+            results.append(SearchResult(
+                source=document["source"],
+                title=document["title"],
+                snippet=_snippet(document["text"], query),
+                score=round(score, 4),
+            ))
+        return results
+
+
+def _snippet(text: str, query: str, size: int = 500) -> str:
+    # Centered on the first occurrence of a query term
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in tokenize(query)]
+    positions = [position for position in positions if position >= 0]
+    start = max(0, min(positions) - size // 4) if positions else 0
+    snippet = text[start:start + size]
+    return ("…" if start else "") + snippet + ("…" if start + size < len(text) else "")
+
+
+def search_tool(index: SearchIndex) -> FunctionTool:
+    embed = None
+    if index.embedding_model is not None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI()
+
+        async def embed(query: str) -> list[float]:
+            response = await client.embeddings.create(model=index.embedding_model, input=[query])
+            return response.data[0].embedding
+
+    @function_tool
+    async def search_knowledge(query: str, limit: int = 5) -> str:
+        """Searches a local snapshot of the Dagger documentation and past GitHub issues. Fast: use it first for questions about Dagger.
+
+        Args:
+            query: What to look for, in keywords
+            limit: Number of snippets to return
+        """
+        vector = None
+        if embed is not None:
+            try:
+                vector = await embed(query)
+            except Exception as e:
+                # Keyword search alone still works
+                print(f"Failed to embed search query: {e}")
+        return json.dumps([result.__dict__ for result in index.search(query, limit=limit, vector=vector)])
+
+    return search_knowledge
@@ -0,0 +1,177 @@
+import json
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+from context import count_tokens
+from state import StateBackend
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    thread_id INTEGER PRIMARY KEY,
+    summary TEXT,
+    last_message_id INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS items (
+    thread_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    tokens INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, seq)
+);
+"""
+
+
+@dataclass
+class Session:
+    thread_id: int
+    # Summary of the items compacted so far
+    summary: str | None
+    # Last Discord message already part of the session
+    last_message_id: int
+    # Agent run input items (messages, tool calls and their outputs), by sequence number
+    items: list[tuple[int, dict[str, Any]]] = field(default_factory=list)
+    tokens: int = 0
+
+    def inputs(self, delta: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        """Input of the next run: the summary, the stored items, then the new messages."""
+        inputs = []
+        if self.summary:
+            inputs.append({"content": f"Summary of the conversation so far:\n{self.summary}", "role": "system"})
+        inputs.extend(item for _, item in self.items)
+        inputs.extend(delta)
+        return inputs
+
+    def compaction_point(self, keep: int) -> int | None:
+        """
+        Sequence number before which items can be summarized, keeping at least the last `keep`
+        items. The cut is made on a user message so tool calls stay with their outputs.
+        """
+        # The last item is always kept: there would be nothing left to continue from otherwise
+        for i in range(len(self.items) - max(keep, 1), 0, -1):
+            seq, item = self.items[i]
+            if item.get("role") == "user":
+                return seq
+        return None
+
+
+class SessionStore:
+    """
+    SQLite store of thread conversations, so that each thread turn only sends the new messages
+    on top of the previous run items instead of rebuilding the conversation from Discord.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(SCHEMA)
+
+    async def close(self):
+        self._db.close()
+
+    async def load(self, thread_id: int) -> Session | None:
+        row = self._db.execute(
+            "SELECT summary, last_message_id FROM sessions WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        session = Session(thread_id=thread_id, summary=row[0], last_message_id=row[1])
+        for seq, item, tokens in self._db.execute(
+            "SELECT seq, item, tokens FROM items WHERE thread_id = ? ORDER BY seq", (thread_id,)
+        ):
+            session.items.append((seq, json.loads(item)))
+            session.tokens += tokens
+        return session
+
+    async def append(self, thread_id: int, items: list[dict[str, Any]], last_message_id: int):
+        with self._db:
+            self._db.execute(
+                "INSERT INTO sessions (thread_id, last_message_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (thread_id) DO UPDATE SET last_message_id = excluded.last_message_id, updated_at = excluded.updated_at",
+                (thread_id, last_message_id, time.time()),
+            )
+            (seq,) = self._db.execute(
+                "SELECT COALESCE(MAX(seq), -1) FROM items WHERE thread_id = ?", (thread_id,)
+            ).fetchone()
+            for item in items:
+                seq += 1
+                serialized = json.dumps(item)
+                self._db.execute(
+                    "INSERT INTO items (thread_id, seq, item, tokens) VALUES (?, ?, ?, ?)",
+                    (thread_id, seq, serialized, count_tokens(serialized)),
+                )
+
+    async def compact(self, thread_id: int, summary: str, before_seq: int):
+        """Replaces the items before `before_seq` with a summary."""
+        with self._db:
+            self._db.execute("DELETE FROM items WHERE thread_id = ? AND seq < ?", (thread_id, before_seq))
+            self._db.execute(
+                "UPDATE sessions SET summary = ?, updated_at = ? WHERE thread_id = ?",
+                (summary, time.time(), thread_id),
+            )
+
+    async def delete(self, thread_id: int):
+        with self._db:
+            self._db.execute("DELETE FROM items WHERE thread_id = ?", (thread_id,))
+            self._db.execute("DELETE FROM sessions WHERE thread_id = ?", (thread_id,))
+
+
+class StateSessionStore:
+    """
+    Same as SessionStore, on the shared state backend, so that any process (on any node) can
+    pick a thread conversation up. A session is a single JSON value, kept small by compaction.
+
+    Sessions are read, modified and written back: a thread must only be handled by one
+    process at a time, which is the case as long as its guild's shard runs in one process.
+    """
+
+    def __init__(self, backend: StateBackend):
+        self._backend = backend
+
+    async def close(self):
+        pass
+
+    @staticmethod
+    def _key(thread_id: int) -> str:
+        return f"session:{thread_id}"
+
+    async def _get(self, thread_id: int) -> dict[str, Any] | None:
+        value = await self._backend.get(self._key(thread_id))
+        return json.loads(value) if value is not None else None
+
+    async def _set(self, thread_id: int, data: dict[str, Any]):
+        data["updated_at"] = time.time()
+        await self._backend.set(self._key(thread_id), json.dumps(data))
+
+    async def load(self, thread_id: int) -> Session | None:
+        data = await self._get(thread_id)
+        if data is None:
+            return None
+        session = Session(thread_id=thread_id, summary=data["summary"], last_message_id=data["last_message_id"])
+        for seq, item, tokens in data["items"]:
+            session.items.append((seq, item))
+            session.tokens += tokens
+        return session
+
+    async def append(self, thread_id: int, items: list[dict[str, Any]], last_message_id: int):
+        data = await self._get(thread_id) or {"summary": None, "items": []}
+        data["last_message_id"] = last_message_id
+        seq = data["items"][-1][0] if data["items"] else -1
+        for item in items:
+            seq += 1
+            data["items"].append([seq, item, count_tokens(json.dumps(item))])
+        await self._set(thread_id, data)
+
+    async def compact(self, thread_id: int, summary: str, before_seq: int):
+        """Replaces the items before `before_seq` with a summary."""
+        data = await self._get(thread_id)
+        if data is None:
+            return
+        data["summary"] = summary
+        data["items"] = [entry for entry in data["items"] if entry[0] >= before_seq]
+        await self._set(thread_id, data)
+
+    async def delete(self, thread_id: int):
+        await self._backend.delete(self._key(thread_id))
@@ -0,0 +1,128 @@
+import asyncio
+import multiprocessing
+import time
+
+
+def shard_groups(shard_count: int, processes: int) -> list[list[int]]:
+    """Splits shards between processes, as evenly as possible."""
+    processes = max(1, min(processes, shard_count))
+    return [list(range(shard_count))[i::processes] for i in range(processes)]
+
+
+async def _run_worker(index: int, shard_ids: list[int], shard_count: int, allow_dms: bool):
+    from startup import STARTUP
+    with STARTUP.phase("imports"):
+        import discord
+        from bot import Bot
+        from config import CONFIG
+
+    intents = discord.Intents.default()
+    intents.message_content = True
+    client = await Bot.create(
+        intents=intents,
+        allow_dms=allow_dms,
+        shard_ids=shard_ids,
+        shard_count=shard_count,
+        worker=index,
+    )
+    await client.start(CONFIG.DISCORD_TOKEN, reconnect=True)
+
+
+def _worker(index: int, shard_ids: list[int], shard_count: int, allow_dms: bool):
+    import discord
+    discord.utils.setup_logging()
+    print(f"Worker {index} starting with shards {shard_ids} of {shard_count}")
+    asyncio.run(_run_worker(index, shard_ids, shard_count, allow_dms))
+
+
+class ShardSupervisor:
+    """
+    Runs one bot process per group of shards, and restarts processes that exit, with
+    exponential backoff when they keep crashing.
+
+    Each process has its own event loop, MCP servers and in-process caches; state that must
+    be seen by all of them goes through the STATE_BACKEND_URL backend.
+
+    The groups can be spread over several nodes: with `node_count` nodes, `processes` is the
+    total number of groups, and each node only runs those whose index modulo `node_count` is
+    its `node_index`. Workers keep their global group index, so their names don't collide.
+    """
+
+    def __init__(
+        self,
+        shard_count: int,
+        processes: int,
+        allow_dms: bool = False,
+        node_index: int = 0,
+        node_count: int = 1,
+        backoff_initial: float = 1,
+        backoff_max: float = 60,
+        # A process running this long is considered healthy again, resetting its backoff
+        stable_after: float = 300,
+    ):
+        if not 0 <= node_index < node_count:
+            raise ValueError(f"Node index {node_index} out of range for {node_count} nodes")
+        self._shard_count = shard_count
+        groups = shard_groups(shard_count, processes)
+        if node_count > len(groups):
+            raise ValueError(f"{node_count} nodes for only {len(groups)} groups of shards, some would be idle")
+        # Global group indexes run by this node
+        self._indexes = list(range(node_index, len(groups), node_count))
+        self._groups = [groups[i] for i in self._indexes]
+        self._node = f"node {node_index + 1}/{node_count}"
+        self._allow_dms = allow_dms
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._stable_after = stable_after
+        # Processes are spawned rather than forked: the parent's event loop must not be inherited
+        self._context = multiprocessing.get_context("spawn")
+        self._processes: list[multiprocessing.Process | None] = [None] * len(self._groups)
+        self._started_at = [0.0] * len(self._groups)
+        self._backoff = [backoff_initial] * len(self._groups)
+        self._restart_at = [0.0] * len(self._groups)
+
+    def _start(self, index: int):
+        worker = self._indexes[index]
+        process = self._context.Process(
+            target=_worker,
+            args=(worker, self._groups[index], self._shard_count, self._allow_dms),
+            name=f"bot-worker-{worker}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _check(self, index: int):
+        process = self._processes[index]
+        now = time.monotonic()
+        if process is not None:
+            if process.is_alive():
+                if now - self._started_at[index] > self._stable_after:
+                    self._backoff[index] = self._backoff_initial
+                return
+            print(f"Worker {self._indexes[index]} exited with code {process.exitcode}, restarting in {self._backoff[index]:.0f}s")
+            self._processes[index] = None
+            self._restart_at[index] = now + self._backoff[index]
+            self._backoff[index] = min(self._backoff[index] * 2, self._backoff_max)
+        if now >= self._restart_at[index]:
+            self._start(index)
+
+    async def run(self):
+        print(f"Running {self._shard_count} shards in {len(self._groups)} processes ({self._node}): {self._groups}")
+        try:
+            while True:
+                for index in range(len(self._groups)):
+                    self._check(index)
+                await asyncio.sleep(1)
+        finally:
+            self.stop()
+
+    def stop(self):
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.kill()
@@ -0,0 +1,112 @@
+import hashlib
+import re
+from typing import Hashable
+
+_MENTION = re.compile(r"<[@#][!&]?\d+>|@\S+")
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Mersenne prime larger than any 32-bit hash, for the permutations
+_PRIME = (1 << 61) - 1
+
+
+def normalize(text: str) -> str:
+    """Lowercases text and strips mentions, punctuation and extra whitespace."""
+    text = _MENTION.sub(" ", text.lower())
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def shingles(text: str, size: int = 4) -> set[str]:
+    """Character n-grams of normalized text."""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=4).digest(), "little")
+
+
+class MinHasher:
+    """
+    Computes MinHash signatures: the fraction of equal values between two signatures
+    estimates the Jaccard similarity of the shingle sets they were computed from.
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.num_perm = num_perm
+        # Deterministic permutation coefficients, so signatures stay comparable across runs
+        self._permutations = []
+        for i in range(num_perm):
+            digest = hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=16).digest()
+            a = int.from_bytes(digest[:8], "little") % (_PRIME - 1) + 1
+            b = int.from_bytes(digest[8:], "little") % _PRIME
+            self._permutations.append((a, b))
+
+    def signature(self, features: set[str]) -> tuple[int, ...]:
+        if not features:
+            return (_PRIME,) * self.num_perm
+        hashes = [_hash(feature) for feature in features]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._permutations)
+
+
+def similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    if not a or len(a) != len(b):
+        return 0.0
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class LSHIndex:
+    """
+    Locality-sensitive index over MinHash signatures. Signatures are split into `bands`:
+    two signatures sharing any band are candidates, so near-duplicates are found without
+    comparing against every entry.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self._rows = num_perm // bands
+        self._buckets: list[dict[tuple[int, ...], set[Hashable]]] = [{} for _ in range(bands)]
+        self._signatures: dict[Hashable, tuple[int, ...]] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _bands(self, signature: tuple[int, ...]):
+        for i, buckets in enumerate(self._buckets):
+            yield buckets, signature[i * self._rows:(i + 1) * self._rows]
+
+    def add(self, key: Hashable, signature: tuple[int, ...]):
+        self.remove(key)
+        self._signatures[key] = signature
+        for buckets, band in self._bands(signature):
+            buckets.setdefault(band, set()).add(key)
+
+    def remove(self, key: Hashable):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        for buckets, band in self._bands(signature):
+            keys = buckets.get(band)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del buckets[band]
+
+    def signature(self, key: Hashable) -> tuple[int, ...] | None:
+        return self._signatures.get(key)
+
+    def query(self, signature: tuple[int, ...], threshold: float = 0.0, limit: int | None = None) -> list[tuple[Hashable, float]]:
+        """Returns the candidates at least `threshold` similar to `signature`, most similar first."""
+        candidates: set[Hashable] = set()
+        for buckets, band in self._bands(signature):
+            candidates |= buckets.get(band, set())
+        matches = []
+        for key in candidates:
+            score = similarity(signature, self._signatures[key])
+            if score >= threshold:
+                matches.append((key, score))
+        matches.sort(key=lambda match: match[1], reverse=True)
+        return matches[:limit] if limit is not None else matches
@@ -0,0 +1,40 @@
+import time
+from contextlib import contextmanager
+
+# Kept free of heavy imports: it's imported first to time the others
+
+
+class StartupTimer:
+    """Records how long each startup phase took, and when it ended, relative to process start."""
+
+    def __init__(self):
+        self._start = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []
+        self.reported = False
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._start
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.phases.append((name, end - start, end - self._start))
+
+    def mark(self, name: str):
+        """Records a point in time, e.g. the gateway connection, as a phase taking no time."""
+        self.phases.append((name, 0.0, self.elapsed()))
+
+    def report(self):
+        if self.reported:
+            return
+        self.reported = True
+        print(f"Startup report ({self.elapsed():.2f}s since start):")
+        for name, duration, end in sorted(self.phases, key=lambda phase: phase[2]):
+            print(f"  {name:<24} {duration:7.3f}s  (done at {end:.3f}s)")
+
+
+STARTUP = StartupTimer()
@@ -0,0 +1,205 @@
+import asyncio
+import time
+from urllib.parse import urlparse
+
+
+class StateBackend:
+    """
+    Key-value store for state shared between the bot's processes: cached responses, rate
+    limiter counters, thread sessions. Values are strings, and expire after `ttl` seconds
+    when one is given.
+    """
+
+    # Whether other processes see the same state
+    shared = False
+
+    async def get(self, key: str) -> str | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        """Adds `amount` to a counter, setting its expiry when it's created. Returns the new value."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend(StateBackend):
+    """In-process backend, for a single process."""
+
+    def __init__(self):
+        self._values: dict[str, tuple[str, float | None]] = {}
+
+    def _live(self, key: str) -> tuple[str, float | None] | None:
+        item = self._values.get(key)
+        if item is not None and item[1] is not None and item[1] < time.monotonic():
+            del self._values[key]
+            return None
+        return item
+
+    async def get(self, key: str) -> str | None:
+        item = self._live(key)
+        return item[0] if item is not None else None
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        self._values[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        item = self._live(key)
+        if item is None:
+            item = ("0", time.monotonic() + ttl if ttl is not None else None)
+        value = int(item[0]) + amount
+        self._values[key] = (str(value), item[1])
+        return value
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisBackend(StateBackend):
+    """
+    Backend shared by processes on several nodes, talking RESP to any Redis-compatible
+    server (Redis, Valkey, KeyDB, a local stand-in...). Commands are pipelined on a single
+    connection.
+    """
+
+    shared = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0, password: str | None = None):
+        self._host = host
+        self._port = port
+        self._db = db
+        self._password = password
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._pending: asyncio.Queue[asyncio.Future] = asyncio.Queue()
+        self._lock = asyncio.Lock()
+        self._reader_task: asyncio.Task | None = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        self._reader_task = asyncio.create_task(self._read_loop(), name="redis-reader")
+        try:
+            if self._password:
+                await self._command("AUTH", self._password)
+            if self._db:
+                await self._command("SELECT", str(self._db))
+        except Exception as e:
+            # Don't leave a connection with the wrong credentials or database behind
+            self._reader_task.cancel()
+            self._disconnect(e)
+            raise
+
+    def _disconnect(self, error: BaseException):
+        # The next call reconnects. Replies still expected will never come (or can't be
+        # matched to their command anymore): fail their callers.
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        while not self._pending.empty():
+            future = self._pending.get_nowait()
+            if not future.done():
+                future.set_exception(ConnectionError(f"State backend connection lost: {error}"))
+
+    async def _read_reply(self):
+        line = (await self._reader.readline()).rstrip(b"\r\n")
+        if not line:
+            raise ConnectionError("Connection to the state backend closed")
+        kind, rest = line[:1], line[1:]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await self._reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if kind == b"*":
+            length = int(rest)
+            if length < 0:
+                return None
+            return [await self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    async def _read_loop(self):
+        # Replies come back in the order commands were sent
+        try:
+            while True:
+                reply = await self._read_reply()
+                future = await self._pending.get()
+                if not future.done():
+                    if isinstance(reply, RedisError):
+                        future.set_exception(reply)
+                    else:
+                        future.set_result(reply)
+        except Exception as e:
+            # Including unparseable replies: the stream is out of sync from then on
+            self._disconnect(e)
+
+    async def _command(self, *args: str):
+        future = asyncio.get_running_loop().create_future()
+        payload = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg.encode()
+            payload.append(f"${len(data)}\r\n".encode() + data + b"\r\n")
+        self._pending.put_nowait(future)
+        self._writer.write(b"".join(payload))
+        return await future
+
+    async def _call(self, *args: str):
+        async with self._lock:
+            if self._writer is None:
+                await self._connect()
+        return await self._command(*args)
+
+    async def get(self, key: str) -> str | None:
+        return await self._call("GET", key)
+
+    async def set(self, key: str, value: str, ttl: float | None = None):
+        if ttl is None:
+            await self._call("SET", key, value)
+        else:
+            await self._call("SET", key, value, "PX", str(int(ttl * 1000)))
+
+    async def delete(self, key: str):
+        await self._call("DEL", key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: float | None = None) -> int:
+        value = await self._call("INCRBY", key, str(amount))
+        if ttl is not None and value == amount:
+            await self._call("PEXPIRE", key, str(int(ttl * 1000)))
+        return value
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        self._disconnect(ConnectionError("closed"))
+
+
+def backend_from_url(url: str) -> StateBackend:
+    """memory:// for in-process state, redis://[:password@]host[:port][/db] for shared state."""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "redis":
+        return RedisBackend(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(parsed.path.lstrip("/") or 0),
+            password=parsed.password,
+        )
+    raise ValueError(f"Unsupported state backend: {url}")
@@ -0,0 +1,142 @@
+import asyncio
+import contextlib
+
+import discord
+from agents import RawResponsesStreamEvent, RunItemStreamEvent, RunResultStreaming
+
+from governor import GOVERNOR
+
+# Discord rejects messages longer than this
+MESSAGE_LIMIT = 2000
+
+# Discord rejects empty messages too: posted when a run ends without any text
+EMPTY_RESPONSE = "_I don't have an answer to that._"
+
+def split_message(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    # Split on line breaks when possible, then on spaces, then anywhere
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+class StreamingReply:
+    """
+    A reply that is progressively edited as the response comes in.
+
+    Updates are coalesced so that messages are edited at most once per `edit_interval`
+    seconds, and the text is spread over several messages once it exceeds Discord's limit.
+    """
+
+    def __init__(self, message: discord.Message, reference: bool = True, edit_interval: float = 1.0):
+        self._message = message
+        self._reference = reference
+        self._edit_interval = edit_interval
+        self._posted: list[discord.Message] = []
+        self._text = ""
+        self._dirty = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._flusher: asyncio.Task | None = None
+
+    async def start(self, placeholder: str = "Thinking…"):
+        await self._render(placeholder)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def update(self, text: str):
+        self._text = text
+        self._dirty.set()
+
+    async def _stop_flusher(self):
+        # Cancelling the flusher in the middle of a render could lose track of a message it
+        # just posted, which would then never be edited nor deleted: let the render finish
+        if self._flusher is None:
+            return
+        self._stopping.set()
+        self._dirty.set()
+        # Shielded so that cancelling us doesn't cancel the flusher anyway
+        try:
+            await asyncio.shield(self._flusher)
+        except Exception as e:
+            # Only intermediate updates are lost: finish renders the whole text again
+            print(f"Failed to update the reply: {e!r}")
+        self._flusher = None
+
+    async def finish(self, text: str):
+        await self._stop_flusher()
+        if not text or not text.strip():
+            text = EMPTY_RESPONSE
+        await self._render(text)
+
+    async def discard(self):
+        """Deletes what was posted so far, e.g. when the question was edited or deleted."""
+        await self._stop_flusher()
+        for posted in self._posted:
+            await GOVERNOR.discord("delete", self._message.channel.id)
+            await posted.delete()
+        self._posted.clear()
+
+    async def stream(self, result: RunResultStreaming):
+        """Renders the events of a streamed run as they arrive."""
+        text = ""
+        status = ""
+        async for event in result.stream_events():
+            if isinstance(event, RawResponsesStreamEvent):
+                if event.data.type == "response.created":
+                    # Only the last model response ends up in the final output
+                    text = ""
+                elif event.data.type == "response.output_text.delta":
+                    text += event.data.delta
+                    status = ""
+            elif isinstance(event, RunItemStreamEvent):
+                if event.name == "tool_called":
+                    status = f"_Calling {getattr(event.item.raw_item, 'name', 'tool')}…_"
+                elif event.name == "tool_output":
+                    status = "_Thinking…_"
+            self.update(f"{text}\n\n{status}".strip() if status else text)
+
+        # stream_events swallows our cancellation and just stops: stop the run as well, and
+        # carry the cancellation on so that the partial output isn't taken as the answer
+        task = asyncio.current_task()
+        if task is not None and task.cancelling():
+            result.cancel()
+            raise asyncio.CancelledError()
+
+    async def _flush_loop(self):
+        while True:
+            await self._dirty.wait()
+            if self._stopping.is_set():
+                return
+            self._dirty.clear()
+            if self._text.strip():
+                await self._render(self._text)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._stopping.wait(), timeout=self._edit_interval)
+
+    async def _send(self, content: str) -> discord.Message:
+        await GOVERNOR.discord("send", self._message.channel.id)
+        if self._reference and not self._posted:
+            return await self._message.reply(content=content, suppress_embeds=True)
+        return await self._message.channel.send(content=content, suppress_embeds=True)
+
+    async def _render(self, text: str):
+        chunks = split_message(text)
+        for i, chunk in enumerate(chunks):
+            if i < len(self._posted):
+                if self._posted[i].content != chunk:
+                    await GOVERNOR.discord("edit", self._message.channel.id)
+                    self._posted[i] = await self._posted[i].edit(content=chunk)
+            else:
+                self._posted.append(await self._send(chunk))
+
+        # The text may shrink, e.g. when the model starts a new response
+        for extra in self._posted[len(chunks):]:
+            await GOVERNOR.discord("delete", self._message.channel.id)
+            await extra.delete()
+        del self._posted[len(chunks):]
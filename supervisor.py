@@ -0,0 +1,192 @@
+import asyncio
+import dataclasses
+import time
+from contextlib import asynccontextmanager
+
+from agents import FunctionTool, RunContextWrapper
+from agents.mcp import MCPServer
+
+
+class ServerSupervisor:
+    """
+    Owns the lifecycle of an MCP server: connects it, health-checks it periodically and
+    reconnects with exponential backoff when the subprocess or stream dies.
+
+    Lazy servers are only connected the first time they're used, and are shut down again
+    once they've been idle for `idle_timeout` seconds.
+
+    Connecting, reconnecting and cleaning up all happen in the supervisor's own task, since
+    the MCP transports must be closed from the task that opened them.
+    """
+
+    def __init__(
+        self,
+        server: MCPServer,
+        lazy: bool = False,
+        idle_timeout: float = 300,
+        health_check_interval: float = 30,
+        health_check_timeout: float = 10,
+        backoff_initial: float = 1,
+        backoff_max: float = 60,
+    ):
+        self.server = server
+        self.lazy = lazy
+        self.available = False
+        self._idle_timeout = idle_timeout
+        self._health_check_interval = health_check_interval
+        self._health_check_timeout = health_check_timeout
+        self._backoff_initial = backoff_initial
+        self._backoff_max = backoff_max
+        self._ready = asyncio.Event()
+        self._wake = asyncio.Event()
+        self._demand = asyncio.Event()
+        self._waiters: list[asyncio.Future] = []
+        self._in_use = 0
+        self._last_used = time.monotonic()
+        self._task: asyncio.Task | None = None
+
+    @property
+    def name(self) -> str:
+        return self.server.name
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"supervisor-{self.name}")
+
+    async def wait_ready(self):
+        # Returns once the first connection attempt completed, successful or not.
+        # Lazy servers are ready right away.
+        await self._ready.wait()
+
+    def check_now(self):
+        self._wake.set()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def activate(self) -> bool:
+        """Makes sure the server is connected, spawning it if it's lazy. Returns whether it's available."""
+        if self.available:
+            return True
+        if not self.lazy:
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._demand.set()
+        return await waiter
+
+    @asynccontextmanager
+    async def use(self):
+        """Keeps the server from being shut down for idleness while in use. Yields whether it's available."""
+        if not await self.activate():
+            yield False
+            return
+
+        self._in_use += 1
+        try:
+            yield True
+        finally:
+            self._in_use -= 1
+            self._last_used = time.monotonic()
+
+    def _idle(self) -> bool:
+        return (
+            self.lazy
+            and self._in_use == 0
+            and time.monotonic() - self._last_used >= self._idle_timeout
+        )
+
+    def _notify_waiters(self):
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(self.available)
+        self._waiters.clear()
+
+    async def _healthy(self) -> bool:
+        session = getattr(self.server, "session", None)
+        if session is None:
+            return False
+        try:
+            await asyncio.wait_for(session.send_ping(), timeout=self._health_check_timeout)
+            return True
+        except Exception as e:
+            print(f"MCP server {self.name} failed health check: {e}")
+            return False
+
+    async def _wait_for_check(self):
+        interval = self._health_check_interval
+        if self.lazy:
+            interval = min(interval, self._idle_timeout)
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _run(self):
+        backoff = self._backoff_initial
+        try:
+            while True:
+                if self.lazy:
+                    self._ready.set()
+                    await self._demand.wait()
+
+                try:
+                    await self.server.connect()
+                except Exception as e:
+                    self._ready.set()
+                    self._notify_waiters()
+                    if self.lazy:
+                        # Don't retry in the background, the next use will
+                        print(f"Failed to connect MCP server {self.name}: {e}")
+                        self._demand.clear()
+                        continue
+                    print(f"Failed to connect MCP server {self.name}, retrying in {backoff}s: {e}")
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, self._backoff_max)
+                    continue
+
+                print(f"MCP server {self.name} connected")
+                self.available = True
+                self._last_used = time.monotonic()
+                self._ready.set()
+                self._notify_waiters()
+                backoff = self._backoff_initial
+
+                while True:
+                    await self._wait_for_check()
+                    if self._idle():
+                        print(f"MCP server {self.name} is idle, shutting it down")
+                        self._demand.clear()
+                        break
+                    if not await self._healthy():
+                        break
+
+                self.available = False
+                await self.server.cleanup()
+        finally:
+            self.available = False
+            self._notify_waiters()
+            await self.server.cleanup()
+
+
+def supervised_tool(tool: FunctionTool, supervisor: ServerSupervisor) -> FunctionTool:
+    """Wraps an agent tool so that it activates its MCP server on use, and reports itself unavailable while it's down."""
+
+    async def on_invoke_tool(context: RunContextWrapper, input: str):
+        async with supervisor.use() as available:
+            if not available:
+                return f"The {tool.name} tool is temporarily unavailable, try again later."
+            try:
+                return await tool.on_invoke_tool(context, input)
+            except Exception as e:
+                # The server may have died mid-call: have the supervisor look at it right away
+                supervisor.check_now()
+                return f"The {tool.name} tool failed: {e}"
+
+    return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
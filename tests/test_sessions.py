@@ -0,0 +1,45 @@
+import asyncio
+
+from sessions import Session, SessionStore, StateSessionStore
+from state import MemoryBackend
+
+
+def make_session(roles: list[str]) -> Session:
+    items = [(seq, {"role": role, "content": str(seq)}) for seq, role in enumerate(roles)]
+    return Session(thread_id=1, summary=None, last_message_id=0, items=items)
+
+
+def test_compaction_point_cuts_on_a_user_message():
+    session = make_session(["user", "assistant", "user", "assistant", "user", "assistant"])
+
+    assert session.compaction_point(keep=2) == 4
+    assert session.compaction_point(keep=3) == 2
+    assert session.compaction_point(keep=6) is None
+
+
+def test_compaction_point_without_items_to_keep():
+    session = make_session(["user", "assistant", "user"])
+
+    assert session.compaction_point(keep=0) == 2
+    assert make_session([]).compaction_point(keep=0) is None
+
+
+def test_stores_append_and_compact():
+    async def check(store):
+        await store.append(1, [{"role": "user", "content": "a"}, {"role": "assistant", "content": "b"}], last_message_id=5)
+        await store.append(1, [{"role": "user", "content": "c"}], last_message_id=7)
+        session = await store.load(1)
+        assert session.last_message_id == 7
+        assert [seq for seq, _ in session.items] == [0, 1, 2]
+
+        await store.compact(1, "summary", session.compaction_point(keep=1))
+        session = await store.load(1)
+        assert session.summary == "summary"
+        assert session.items == [(2, {"role": "user", "content": "c"})]
+
+        await store.delete(1)
+        assert await store.load(1) is None
+        await store.close()
+
+    asyncio.run(check(SessionStore(":memory:")))
+    asyncio.run(check(StateSessionStore(MemoryBackend())))
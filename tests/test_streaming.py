@@ -0,0 +1,103 @@
+import asyncio
+
+from agents import Agent, Model, Runner, set_tracing_disabled
+
+from streaming import StreamingReply, split_message
+
+set_tracing_disabled(True)
+
+
+class SlowModel(Model):
+    """Model whose responses never come."""
+
+    def __init__(self):
+        self.cancelled = False
+
+    async def _wait(self):
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+    async def get_response(self, *args, **kwargs):
+        await self._wait()
+
+    async def stream_response(self, *args, **kwargs):
+        await self._wait()
+        yield
+
+
+class FakeChannel:
+    id = 1
+
+
+class FakeMessage:
+    channel = FakeChannel()
+
+
+def test_cancelling_a_streamed_reply_cancels_the_run():
+    async def main():
+        model = SlowModel()
+        result = Runner.run_streamed(Agent(name="slow", model=model), "hello")
+        reply = StreamingReply(FakeMessage())
+        task = asyncio.create_task(reply.stream(result))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+
+        assert task.cancelled()
+        assert model.cancelled
+        assert result.final_output is None
+
+    asyncio.run(main())
+
+
+def test_split_message_drops_the_space_it_splits_on():
+    chunks = split_message("aaaa bbbb cccc", limit=10)
+
+    assert chunks == ["aaaa bbbb", "cccc"]
+
+
+class RecordingChannel(FakeChannel):
+    def __init__(self):
+        self.sent: list["FakePosted"] = []
+
+    async def send(self, content, **kwargs):
+        # Slow enough for the reply to be finished or discarded meanwhile
+        await asyncio.sleep(0.05)
+        posted = FakePosted(self, content)
+        self.sent.append(posted)
+        return posted
+
+
+class FakePosted:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+        self.deleted = False
+
+    async def edit(self, content):
+        self.content = content
+        return self
+
+    async def delete(self):
+        self.deleted = True
+
+
+def test_discarding_a_reply_mid_render_deletes_everything_posted():
+    async def main():
+        message = FakeMessage()
+        message.channel = RecordingChannel()
+        reply = StreamingReply(message, reference=False, edit_interval=0)
+        await reply.start()
+        # The text now spans two messages: the flusher is posting the second one
+        reply.update("word " * 500)
+        await asyncio.sleep(0.01)
+        await reply.discard()
+
+        assert len(message.channel.sent) == 2
+        assert all(posted.deleted for posted in message.channel.sent)
+
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import os
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from agents import FunctionTool, function_tool
+from agents.mcp import MCPServer
+
+from cache import TTLCache
+from governor import GOVERNOR
+
+TRACE_URL = re.compile(r"https?://v3\.dagger\.cloud/([\w.-]+)/([\w-]+)")
+
+
+def trace_urls(text: str) -> list[tuple[str, str, str]]:
+    """(url, org, trace ID) of the Dagger Cloud traces linked in the text."""
+    return [(match.group(0), match.group(1), match.group(2)) for match in TRACE_URL.finditer(text)]
+
+
+@dataclass
+class Span:
+    id: str
+    parent_id: str | None
+    name: str
+    # Seconds since the epoch; end is None while the span is running
+    start: float
+    end: float | None
+    failed: bool
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def to_row(self) -> list:
+        return [self.id, self.parent_id, self.name, self.start, self.end, self.failed]
+
+    @classmethod
+    def from_row(cls, row: list) -> "Span":
+        return cls(*row)
+
+
+def _first(data: dict[str, Any], *keys: str) -> Any:
+    return next((data[key] for key in keys if data.get(key) is not None), None)
+
+
+def _timestamp(value: Any) -> float | None:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+        except ValueError:
+            value = float(value)
+    # Nanoseconds, milliseconds or seconds since the epoch
+    if value > 1e15:
+        return value / 1e9
+    if value > 1e12:
+        return value / 1e3
+    return float(value)
+
+
+def parse_span(data: dict[str, Any]) -> Span:
+    # Field names vary between OpenTelemetry exports and API representations
+    start = _timestamp(_first(data, "start", "start_time", "startTime", "started_at", "startedAt")) or 0.0
+    end = _timestamp(_first(data, "end", "end_time", "endTime", "ended_at", "endedAt"))
+    duration = _first(data, "duration_ms", "durationMs")
+    if end is None and duration is not None:
+        end = start + float(duration) / 1e3
+    status = str(_first(data, "status", "status_code", "statusCode") or "").lower()
+    return Span(
+        id=str(_first(data, "id", "span_id", "spanId", "spanID")),
+        parent_id=_first(data, "parent_id", "parentId", "parentSpanId", "parentSpanID"),
+        name=str(_first(data, "name", "spanName") or ""),
+        start=start,
+        end=end,
+        failed=bool(_first(data, "error", "failed")) or status in ("error", "failed", "status_code_error"),
+    )
+
+
+def parse_trace(payload: Any) -> list[Span]:
+    if isinstance(payload, dict):
+        payload = _first(payload, "spans", "data", "trace") or []
+        if isinstance(payload, dict):
+            return parse_trace(payload)
+    return [parse_span(span) for span in payload if isinstance(span, dict)]
+
+
+class TraceIndex:
+    """Spans of a trace, indexed by parent, with the summaries the cloud agent asks for most."""
+
+    def __init__(self, spans: list[Span]):
+        self.spans = {span.id: span for span in spans}
+        self._children: dict[str | None, list[Span]] = {}
+        for span in spans:
+            parent = span.parent_id if span.parent_id in self.spans else None
+            self._children.setdefault(parent, []).append(span)
+
+    @property
+    def complete(self) -> bool:
+        return all(span.end is not None for span in self.spans.values())
+
+    def roots(self) -> list[Span]:
+        return self._children.get(None, [])
+
+    def children(self, span: Span) -> list[Span]:
+        return self._children.get(span.id, [])
+
+    def slowest(self, limit: int = 10) -> list[Span]:
+        return sorted(self.spans.values(), key=lambda span: span.duration, reverse=True)[:limit]
+
+    def failed_steps(self) -> list[Span]:
+        # The deepest failures: their parents failed because of them
+        return [
+            span for span in self.spans.values()
+            if span.failed and not any(child.failed for child in self.children(span))
+        ]
+
+    def critical_path(self) -> list[Span]:
+        # From the root ending last, follow the child ending last: what the trace waited on
+        path = []
+        candidates = self.roots()
+        while candidates:
+            span = max(candidates, key=lambda span: span.end if span.end is not None else float("inf"))
+            path.append(span)
+            candidates = self.children(span)
+        return path
+
+    def find(self, name: str) -> list[Span]:
+        name = name.lower()
+        return [span for span in self.spans.values() if name in span.name.lower()]
+
+    def summary(self) -> dict[str, Any]:
+        roots = self.roots()
+        start = min((span.start for span in self.spans.values()), default=0.0)
+        end = max((span.end or time.time() for span in self.spans.values()), default=0.0)
+        return {
+            "spans": len(self.spans),
+            "root": roots[0].name if len(roots) == 1 else [span.name for span in roots[:10]],
+            "duration": round(end - start, 3),
+            "complete": self.complete,
+            "failed_steps": [span.name for span in self.failed_steps()[:10]],
+            "slowest": [_span_json(span) for span in self.slowest(5)],
+        }
+
+
+def _span_json(span: Span) -> dict[str, Any]:
+    return {
+        "name": span.name,
+        "duration": round(span.duration, 3),
+        "failed": span.failed,
+        "running": span.end is None,
+    }
+
+
+class TraceCache:
+    """
+    On-disk cache of Dagger Cloud traces, fetched from the cloud MCP server.
+
+    Mentions linking traces trigger a `prefetch` while triage runs, so the trace is usually
+    ready by the time the cloud agent asks about it. Concurrent requests for the same trace
+    share one fetch. Finished traces never change and are kept; running ones are refetched
+    after `ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        fetch: Callable[[str, str, str], Awaitable[Any]],
+        ttl: float = 300,
+        memory_size: int = 32,
+    ):
+        self._directory = directory
+        self._fetch = fetch
+        self._ttl = ttl
+        self._indexes: TTLCache[tuple[float, TraceIndex]] = TTLCache(max_size=memory_size, ttl=24 * 3600)
+        self._tasks: set[asyncio.Task] = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, org: str, trace_id: str) -> str:
+        return os.path.join(self._directory, f"{org}-{trace_id}.json")
+
+    def _fresh(self, fetched_at: float, index: TraceIndex) -> bool:
+        return index.complete or time.time() - fetched_at < self._ttl
+
+    def _load(self, org: str, trace_id: str) -> tuple[float, TraceIndex] | None:
+        try:
+            with open(self._path(org, trace_id)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return data["fetched_at"], TraceIndex([Span.from_row(row) for row in data["spans"]])
+
+    def _store(self, org: str, trace_id: str, fetched_at: float, index: TraceIndex):
+        path = self._path(org, trace_id)
+        # Shard worker processes share the cache directory
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"fetched_at": fetched_at, "spans": [span.to_row() for span in index.spans.values()]}, f)
+        os.replace(temporary, path)
+
+    async def get(self, url: str, org: str, trace_id: str) -> TraceIndex:
+        cached = self._indexes.get((org, trace_id)) or self._load(org, trace_id)
+        if cached is not None and self._fresh(*cached):
+            self._indexes.set((org, trace_id), cached)
+            return cached[1]
+
+        async def fetch() -> TraceIndex:
+            index = TraceIndex(parse_trace(await self._fetch(url, org, trace_id)))
+            fetched_at = time.time()
+            self._indexes.set((org, trace_id), (fetched_at, index))
+            await asyncio.to_thread(self._store, org, trace_id, fetched_at, index)
+            return index
+
+        return await GOVERNOR.coalesce(("trace", org, trace_id), fetch)
+
+    def prefetch(self, text: str):
+        """Starts fetching the traces linked in the text in the background."""
+        for url, org, trace_id in trace_urls(text):
+            task = asyncio.create_task(self._prefetch(url, org, trace_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _prefetch(self, url: str, org: str, trace_id: str):
+        try:
+            await self.get(url, org, trace_id)
+        except Exception as e:
+            print(f"Failed to prefetch trace {url}: {e}")
+
+    async def index(self, url: str) -> TraceIndex:
+        urls = trace_urls(url)
+        if not urls:
+            raise ValueError(f"Not a Dagger Cloud trace URL: {url}")
+        return await self.get(*urls[0])
+
+
+def mcp_trace_fetcher(server: MCPServer, tool_name: str) -> Callable[[str, str, str], Awaitable[Any]]:
+    """Fetches traces with an MCP tool, passing the URL, org and trace ID to the arguments it takes."""
+    properties: dict[str, Any] | None = None
+
+    async def fetch(url: str, org: str, trace_id: str) -> Any:
+        nonlocal properties
+        if properties is None:
+            tools = {tool.name: tool for tool in await server.list_tools()}
+            if tool_name not in tools:
+                raise ValueError(f"The {server.name} MCP server has no {tool_name} tool")
+            properties = tools[tool_name].inputSchema.get("properties", {})
+
+        arguments = {}
+        for name in properties:
+            lowered = name.lower()
+            if "url" in lowered:
+                arguments[name] = url
+            elif "org" in lowered:
+                arguments[name] = org
+            elif "trace" in lowered:
+                arguments[name] = trace_id
+        result = await server.call_tool(tool_name, arguments)
+        text = "".join(getattr(content, "text", "") for content in result.content)
+        if result.isError:
+            raise RuntimeError(text)
+        return json.loads(text)
+
+    return fetch
+
+
+def trace_tools(cache: TraceCache) -> list[FunctionTool]:
+    """Tools giving the cloud agent precomputed views of a trace."""
+
+    @function_tool
+    async def trace_summary(url: str) -> str:
+        """Overview of a Dagger Cloud trace: span count, duration, failed steps and slowest spans.
+
+        Args:
+            url: The trace URL, https://v3.dagger.cloud/<Org>/<TraceID>
+        """
+        return json.dumps((await cache.index(url)).summary())
+
+    @function_tool
+    async def slowest_spans(url: str, limit: int = 10) -> str:
+        """The slowest spans of a Dagger Cloud trace.
+
+        Args:
+            url: The trace URL
+            limit: Number of spans to return
+        """
+        return json.dumps([_span_json(span) for span in (await cache.index(url)).slowest(limit)])
+
+    @function_tool
+    async def failed_steps(url: str) -> str:
+        """The steps of a Dagger Cloud trace that failed, deepest failures only.
+
+        Args:
+            url: The trace URL
+        """
+        return json.dumps([_span_json(span) for span in (await cache.index(url)).failed_steps()])
+
+    @function_tool
+    async def critical_path(url: str) -> str:
+        """The chain of spans the trace waited on, from the root down.
+
+        Args:
+            url: The trace URL
+        """
+        return json.dumps([_span_json(span) for span in (await cache.index(url)).critical_path()])
+
+    @function_tool
+    async def find_spans(url: str, name: str) -> str:
+        """Spans of a Dagger Cloud trace whose name contains the given text.
+
+        Args:
+            url: The trace URL
+            name: Text to look for in span names
+        """
+        return json.dumps([_span_json(span) for span in (await cache.index(url)).find(name)[:50]])
+
+    return [trace_summary, slowest_spans, failed_steps, critical_path, find_spans]